@@ -1,20 +1,62 @@
 import pygame
 import sys
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import copy
+import functools
+import gc
+import itertools
+import json
+import os
+import queue
+import socket
+import socketserver
+import struct
+import subprocess
+import tempfile
+import threading
+import time
 import math
 import random
+import weakref
 
-# Initialize Pygame
-pygame.init()
+import numpy as np
+
+try:
+    from pygame._sdl2 import video as sdl2_video
+except ImportError:  # pygame built without the SDL2 render API
+    sdl2_video = None
 
 # Constants
 SCREEN_WIDTH = 600
 SCREEN_HEIGHT = 400
 FPS = 60
 TILE_SIZE = 32
-GRAVITY = 0.5
-PLAYER_SPEED = 5
-JUMP_POWER = -12
-FRICTION = 0.8
+
+# Player physics runs in 8.8 fixed point: positions and speeds are integers
+# counting 1/256ths of a pixel, so runs are bit-exact and sub-pixel motion
+# is carried from frame to frame instead of truncated away
+SUBPIXEL_SHIFT = 8
+SUBPIXEL = 1 << SUBPIXEL_SHIFT
+GRAVITY = 128            # 0.5 px/frame^2
+PLAYER_SPEED = 1280      # 5 px/frame
+JUMP_POWER = -3072       # -12 px/frame
+MAX_FALL_SPEED = 3840    # 15 px/frame
+FRICTION = 205           # speed * 205/256 per frame (~0.8)
+SPIN_CHARGE_STEP = 128   # 0.5 px/frame per frame held
+SPIN_CHARGE_MAX = 2048   # 8 px/frame
+SLOPE_FACTOR = 32        # downhill pull, 0.125 px/frame^2 * sin(slope)
+
+# Terrain tiles by map character: '1' a full block, '/' and '\' 45 degree
+# slopes, 'a' 'b' the low and high halves of a gentle rise and 'c' 'd' the
+# high and low halves of a gentle fall, '(' and ')' quarter-pipe curves.
+# Shape ids count from 1 in this order; 0 is an empty cell
+TILE_SHAPES = '1/\\abcd()'
+# Ground more than this far above the feet is a wall; grounded players
+# follow ground down to this far below them
+STEP_HEIGHT = 16
 
 # Colors
 SKY_TOP = (100, 200, 255)
@@ -23,6 +65,20 @@ GROUND_COLOR = (34, 139, 34)
 GROUND_STRIPE = (85, 107, 47)
 RING_MAIN = (255, 255, 0)
 RING_HOLE = (50, 50, 50)
+RING_SHINE = (255, 255, 200)
+RING_COLORKEY = (255, 0, 255)
+CLOUD_COLOR = (255, 255, 255, 230)
+MOUNTAIN_FAR = (120, 150, 205)
+MOUNTAIN_NEAR = (80, 150, 95)
+MOUNTAIN_RIDGE = (120, 185, 110)
+WATER_COLOR = (40, 110, 200)
+WATER_SHINE = (150, 210, 255)
+FOLIAGE_DARK = (20, 100, 40)
+FOLIAGE_LIGHT = (45, 140, 60)
+
+# Ring spin animation
+RING_FRAMES = 8
+RING_FRAME_MS = 60
 
 # Sonic CD Palette
 SONIC_BLUE = (66, 170, 255)
@@ -32,40 +88,227 @@ SONIC_RED = (220, 20, 20)
 SONIC_WHITE = (255, 255, 255)
 SONIC_BLACK = (0, 0, 0)
 
+# Player sprites are 8-bit: pattern letters index a palette in this order,
+# with index 0 ('.') transparent. Recolouring swaps the whole palette.
+SPRITE_PALETTE_KEYS = '.BDSRWK'
+SPRITE_COLORKEY = (255, 0, 255)
+SPRITE_PALETTES = {
+    'normal': [SPRITE_COLORKEY, SONIC_BLUE, SONIC_DARK_BLUE, SONIC_SKIN,
+               SONIC_RED, SONIC_WHITE, SONIC_BLACK],
+    'super': [SPRITE_COLORKEY, (255, 230, 90), (230, 170, 30), SONIC_SKIN,
+              SONIC_RED, SONIC_WHITE, SONIC_BLACK],
+    'flash': [SPRITE_COLORKEY, (255, 255, 255), (220, 220, 220), (255, 255, 255),
+              (255, 255, 255), (255, 255, 255), (160, 160, 160)],
+    'past': [SPRITE_COLORKEY, (150, 140, 200), (100, 80, 150), (235, 200, 160),
+             (190, 60, 50), (250, 240, 220), (30, 20, 30)],
+    'future': [SPRITE_COLORKEY, (60, 200, 230), (30, 110, 160), (230, 230, 210),
+               (240, 40, 110), (230, 255, 255), (10, 20, 40)],
+}
 MENU_BG = (30, 30, 60)
 TEXT_COLOR = (255, 255, 255)
 SELECTED_COLOR = (255, 255, 0)
+VIEWPORT_DIVIDER = (0, 0, 0)
+
+# Particles
+MAX_PARTICLES = 512
+PARTICLE_RING = 0
+PARTICLE_DUST = 1
+PARTICLE_SPARK = 2
+# Per-kind physics, indexed by particle kind
+PARTICLE_GRAVITY = np.array([0.1875, -0.02, 0.15], dtype=np.float32)
+PARTICLE_BOUNCE = np.array([0.75, 0.0, 0.4], dtype=np.float32)
+
+# Render layers (drawn back to front)
+LAYER_BACKGROUND = 0
+LAYER_TILES = 1
+LAYER_RINGS = 2
+LAYER_PLAYER = 3
+LAYER_PARTICLES = 4
+
+# Level tiles are baked into chunk surfaces this many tiles wide
+CHUNK_TILES = 8
+CHUNK_WIDTH = CHUNK_TILES * TILE_SIZE
+# Transparent colour of baked chunks (colorkey + RLE blits skip empty space)
+CHUNK_COLORKEY = (255, 0, 255)
+
+# Parallax strips are baked this wide and tiled horizontally
+PARALLAX_WIDTH = 1024
+
+# Pixel memory every baked surface together may hold before the least
+# recently used are dropped (and re-baked when next needed)
+SURFACE_BUDGET = 64 * 1024 * 1024
+
+# Grass tufts poke this many pixels above the top of a tile
+TUFT_HEIGHT = 4
+
+# Audio: a small mixer buffer keeps effects within a frame of their event
+AUDIO_RATE = 22050
+AUDIO_BUFFER = 256  # samples, ~12 ms at 22 kHz
+AUDIO_VOICES = 8
+
+# Frame capture: slots in the ring buffer between game loop and encoder
+CAPTURE_SLOTS = 8
+
+# Telemetry: records are handed to the writer thread in batches this big
+TELEMETRY_BATCH = 256
+
+# Sampling profiler: default stacks captured per second, and the GIL switch
+# interval while sampling (see SamplingProfiler)
+PROFILE_RATE = 50
+PROFILE_SWITCH_INTERVAL = 0.001
+
+# Remote control: one bit per button in an action byte
+ACTION_LEFT = 1
+ACTION_RIGHT = 2
+ACTION_JUMP = 4
+ACTION_DOWN = 8
+
+# Split-screen: racers after the first start this far apart
+RACER_SPACING = 40
 
 # Game states
 MENU = 0
 PLAYING = 1
+PLAYING_SPLIT = 2
 
 # ----------------------------------------------------------------------
-# Simple tile map for Green Hill Zone
+# Simple tile map for Green Hill Zone (0 = empty, 1 = solid ground, the
+# other TILE_SHAPES characters = slopes and curves, R = a ring resting on
+# the bottom of that cell)
 level_map = [
     "00000000000000000000000000000000000000000000000000000000000000000000000000000000",
     "00000000000000000000000000000000000000000000000000000000000000000000000000000000",
-    "00000000000000000000000000000000000000000000000000000000000000000000000000000000",
+    "00000000000000000000000000000000000000000000000000R00000000000000000000000000000",
     "00000000000000000000000000000000000000000000001110000000001110000000000000000000",
-    "00000000000000000000000000000000000000000000000000000000000000000000000000000000",
+    "0000000000000000000000000000000000000000R000000000000000000000000000000000000000",
     "00000000000000000000000000000000000000000000000011100011110000000000000000000000",
-    "00000000000000000000000000000000000000000000000000000000000000000000000000000000",
+    "0000000000000000000000000000000000000000000000000000000R000000000000000000000000",
     "00000000000000000000000000000000000000000000000000011111000000000000000000000000",
     "00000000000000000000000000000000000000000000000000000000000000000000000000000000",
-    "00000000000000000000000000000000000000000000000000000000000000000000000000000000",
-    "00000000000000000000000000000000000000000000000000000000000000000000000000000000",
+    "0000000000000000000R0000000000000000000000000000000000000000000000R0000000000000",
+    "(000000000000000ab111cd000000000000000000000000000000000000000000/11\\0000000000)",
     "11111111111111111111111111111111111111111111111111111111111111111111111111111111",
 ]
 
+# The zone in other time periods, as (row, col, cells) overwrites of
+# level_map. Periods share everything they do not change.
+ZONE_PERIODS = ('past', 'present', 'future')
+ZONE_EDITS = {
+    'past': [(7, 13, "R"), (8, 12, "1111"), (5, 21, "R"), (6, 20, "111")],
+    'future': [(2, 50, "0"), (5, 48, "000"), (8, 31, "R"), (9, 30, "1111")],
+}
+
+# ----------------------------------------------------------------------
+def surface_bytes(surface):
+    """Pixel memory a surface holds; a subsurface shares its parent's and counts 0."""
+    if surface.get_parent() is not None:
+        return 0
+    return surface.get_pitch() * surface.get_height()
+
+
+class SurfaceCache:
+    """Every baked surface the game keeps, accounted against one byte budget.
+
+    get(key, bake) returns the surface cached under key, calling bake() to
+    build it on a miss.  Entries are kept in least-recently-used order and
+    once the resident bytes exceed budget the stalest are dropped; the next
+    get() for one of them just bakes it again.  Callers therefore hold on
+    to keys and bake functions, not surfaces, from one frame to the next.
+
+    The level loader bakes from its own thread, so bookkeeping is done
+    under a lock; bakes run outside it.
+    """
+
+    def __init__(self, budget=SURFACE_BUDGET):
+        self.budget = budget
+        self.entries = collections.OrderedDict()  # key -> (surface, bytes)
+        self.resident = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def get(self, key, bake):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.hits += 1
+                self.entries.move_to_end(key)
+                return entry[0]
+            self.misses += 1
+        surface = bake()
+        with self._lock:
+            self._store(key, surface)
+        return surface
+
+    def peek(self, key):
+        """The surface cached under key, or None; neither counted nor made recent."""
+        entry = self.entries.get(key)
+        return entry[0] if entry else None
+
+    def discard(self, key):
+        """Drops key now, for surfaces that will never be asked for again."""
+        with self._lock:
+            entry = self.entries.pop(key, None)
+            if entry:
+                self.resident -= entry[1]
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.resident = self.hits = self.misses = self.evictions = 0
+
+    def _store(self, key, surface):
+        old = self.entries.pop(key, None)
+        if old:
+            self.resident -= old[1]
+        size = surface_bytes(surface)
+        self.entries[key] = (surface, size)
+        self.resident += size
+        # The newest entry stays even when it alone is over budget
+        while self.resident > self.budget and len(self.entries) > 1:
+            _, (_, size) = self.entries.popitem(last=False)
+            self.resident -= size
+            self.evictions += 1
+
+    def report(self):
+        lookups = self.hits + self.misses
+        hit_rate = self.hits / lookups * 100 if lookups else 0.0
+        return (f"surfaces: {len(self.entries)} resident, {self.resident / 1024:.0f} of "
+                f"{self.budget / 1024:.0f} KiB, {hit_rate:.1f}% hits of {lookups} lookups, "
+                f"{self.evictions} evicted")
+
+
+surface_cache = SurfaceCache()
+
 # ----------------------------------------------------------------------
 class Player:
+    # One 8-bit sheet holds every frame, facing right on the top row and
+    # mirrored below; the sheet lives in surface_cache under SHEET_KEY and
+    # sprite_cache maps state -> frame rects for each facing
+    SHEET_KEY = 'player-sheet'
+    sprite_cache = None
+    palette = 'normal'
+
     def __init__(self, x, y):
         # Make the hitbox slightly smaller than the tile for better feel
         self.rect = pygame.Rect(x, y, 28, 32)
-        self.vx = 0
-        self.vy = 0
+        # Fixed-point position (of rect.topleft) and speed; rect is derived
+        self.xpos = x << SUBPIXEL_SHIFT
+        self.ypos = y << SUBPIXEL_SHIFT
+        self.xsp = 0
+        self.ysp = 0
         self.on_ground = False
+        # Byte angle of the ground under the player (0 when airborne)
+        self.angle = 0
         self.facing_right = True
+        self.spin_charge = 0
+        self.ring_count = 0
+
+        # Gameplay events raised during the last update ('jump', 'land',
+        # 'ring', 'spin_start', 'spin_charge', 'spin_release'), consumed by
+        # play_game
+        self.events = []
         
         # Animation State
         self.state = 'idle'
@@ -73,31 +316,51 @@ class Player:
         self.anim_timer = 0
         self.animation_speed = 8 # Lower is faster
         
-        # Generate sprites
-        self.sprites = self._load_sprites()
+        # Sprites (plus mirrored copies for facing left) are generated once
+        # and shared by every Player
+        if Player.sprite_cache is None:
+            sheet, sprites, flipped = self._load_sprites()
+            Player.sprite_cache = (sprites, flipped)
+            surface_cache.get(Player.SHEET_KEY, lambda: sheet)
+        self.sprites, self.flipped_sprites = Player.sprite_cache
+
+    @staticmethod
+    def sprite_sheet():
+        """The shared sheet, re-baked in the current palette if it was evicted."""
+        return surface_cache.get(Player.SHEET_KEY, lambda: Player._load_sprites()[0])
 
-    def _draw_pixel_art(self, surface, pattern, colors, offset=(0,0)):
-        """Helper to draw pixel art from a string list."""
+    @staticmethod
+    def set_palette(name):
+        """Recolours every Player at once (time zones, super form, damage flash).
+
+        Only the shared sheet's palette changes; no pixels are touched.
+        """
+        Player.palette = name
+        sheet = surface_cache.peek(Player.SHEET_KEY)
+        if sheet is not None:
+            sheet.set_palette(SPRITE_PALETTES[name])
+
+    @staticmethod
+    def _draw_pixel_art(pixels, pattern, colors, offset=(0,0)):
+        """Helper to write pixel art from a string list as palette indices."""
         x_off, y_off = offset
         for y, row in enumerate(pattern):
             for x, char in enumerate(row):
                 if char != '.' and char in colors:
-                    pygame.draw.rect(surface, colors[char], (x + x_off, y + y_off, 1, 1))
+                    pixels[y + y_off, x + x_off] = colors[char]
 
-    def _load_sprites(self):
-        """Generates a dictionary of sprite surfaces for different states."""
+    @classmethod
+    def _load_sprites(cls):
+        """Builds the 8-bit sprite sheet; returns it with per-state frame rects."""
         sprites = {
             'idle': [],
             'run': [],
             'jump': []
         }
         
-        # Palette Map for the generator
+        # Palette indices for the generator
         # B: Blue, D: Dark Blue, S: Skin, R: Red, W: White, K: Black/Outline
-        C = {
-            'B': SONIC_BLUE, 'D': SONIC_DARK_BLUE, 'S': SONIC_SKIN,
-            'R': SONIC_RED, 'W': SONIC_WHITE, 'K': SONIC_BLACK
-        }
+        C = {char: index for index, char in enumerate(SPRITE_PALETTE_KEYS)}
 
         # --- IDLE SPRITE (32x32) ---
         # Classic standing pose
@@ -130,8 +393,8 @@ class Player:
             "..............DDDD.........",
         ]
         
-        surf = pygame.Surface((32, 32), pygame.SRCALPHA)
-        self._draw_pixel_art(surf, idle_pattern, C, offset=(2, 4))
+        surf = np.zeros((32, 32), np.uint8)
+        cls._draw_pixel_art(surf, idle_pattern, C, offset=(2, 4))
         sprites['idle'].append(surf)
 
         # --- RUN FRAMES (32x32) ---
@@ -164,8 +427,8 @@ class Player:
             ".............DDDDDK........",
             "..............DDDD.........",
         ]
-        surf1 = pygame.Surface((32, 32), pygame.SRCALPHA)
-        self._draw_pixel_art(surf1, run1, C, offset=(2, 4))
+        surf1 = np.zeros((32, 32), np.uint8)
+        cls._draw_pixel_art(surf1, run1, C, offset=(2, 4))
         sprites['run'].append(surf1)
 
         # Frame 2: Legs together (blur effect)
@@ -197,8 +460,8 @@ class Player:
             ".............DDDDDK........",
             "..............DDDD.........",
         ]
-        surf2 = pygame.Surface((32, 32), pygame.SRCALPHA)
-        self._draw_pixel_art(surf2, run2, C, offset=(2, 4))
+        surf2 = np.zeros((32, 32), np.uint8)
+        cls._draw_pixel_art(surf2, run2, C, offset=(2, 4))
         sprites['run'].append(surf2)
 
         # --- JUMP SPRITE (Ball) ---
@@ -217,45 +480,120 @@ class Player:
             "....DDBBBBBBBBBBBBBDD...",
             "......DDDDDDDDDDDD......",
         ]
-        surf_j = pygame.Surface((32, 32), pygame.SRCALPHA)
-        self._draw_pixel_art(surf_j, jump_pattern, C, offset=(3, 10))
+        surf_j = np.zeros((32, 32), np.uint8)
+        cls._draw_pixel_art(surf_j, jump_pattern, C, offset=(3, 10))
         sprites['jump'].append(surf_j)
 
-        return sprites
+        # Lay the frames out in a row, mirrored copies in a second row
+        frames = [frame for state in sprites for frame in sprites[state]]
+        row = np.hstack(frames)
+        pixels = np.vstack([row, np.hstack([frame[:, ::-1] for frame in frames])])
+        sheet = pygame.image.frombytes(pixels.tobytes(), (pixels.shape[1], 32 * 2), 'P')
+        sheet.set_palette(SPRITE_PALETTES[Player.palette])
+        sheet.set_colorkey(SPRITE_COLORKEY)
+
+        rects, flipped = {}, {}
+        index = 0
+        for state, state_frames in sprites.items():
+            rects[state] = [pygame.Rect(32 * (index + i), 0, 32, 32)
+                            for i in range(len(state_frames))]
+            flipped[state] = [rect.move(0, 32) for rect in rects[state]]
+            index += len(state_frames)
+        return sheet, rects, flipped
+
+    @property
+    def vx(self):
+        """Horizontal speed in pixels per frame."""
+        return self.xsp / SUBPIXEL
+
+    @vx.setter
+    def vx(self, value):
+        self.xsp = round(value * SUBPIXEL)
+
+    @property
+    def vy(self):
+        """Vertical speed in pixels per frame."""
+        return self.ysp / SUBPIXEL
+
+    @vy.setter
+    def vy(self, value):
+        self.ysp = round(value * SUBPIXEL)
+
+    def update(self, terrain, rings, keys=None):
+        """Advances one frame on terrain; keys defaults to the live keyboard state."""
+        self.events.clear()
+        was_on_ground = self.on_ground
 
-    def update(self, tiles, rings):
         # Horizontal movement
-        keys = pygame.key.get_pressed()
+        if keys is None:
+            keys = pygame.key.get_pressed()
         moving = False
-        if keys[pygame.K_LEFT]:
-            self.vx = -PLAYER_SPEED
+        if keys[pygame.K_DOWN] and self.on_ground:
+            # Spin dash: hold DOWN to rev up, release to launch
+            if not self.spin_charge:
+                self.events.append('spin_start')
+            self.spin_charge = min(self.spin_charge + SPIN_CHARGE_STEP, SPIN_CHARGE_MAX)
+            self.xsp = 0
+            self.events.append('spin_charge')
+        elif self.spin_charge:
+            direction = 1 if self.facing_right else -1
+            self.xsp = direction * (PLAYER_SPEED + self.spin_charge)
+            self.spin_charge = 0
+            self.events.append('spin_release')
+        elif keys[pygame.K_LEFT]:
+            self.xsp = -PLAYER_SPEED
             self.facing_right = False
             moving = True
         elif keys[pygame.K_RIGHT]:
-            self.vx = PLAYER_SPEED
+            self.xsp = PLAYER_SPEED
             self.facing_right = True
             moving = True
         else:
-            self.vx *= FRICTION
+            if self.xsp >= 0:
+                self.xsp = self.xsp * FRICTION >> SUBPIXEL_SHIFT
+            else:
+                # Scale the magnitude so friction settles on 0 from both sides
+                self.xsp = -(-self.xsp * FRICTION >> SUBPIXEL_SHIFT)
+            # Slopes pull a coasting player downhill
+            if self.on_ground:
+                self.xsp -= SLOPE_FACTOR * SINE[self.angle] >> SUBPIXEL_SHIFT
 
         # Jump
-        if keys[pygame.K_SPACE] and self.on_ground:
-            self.vy = JUMP_POWER
+        if keys[pygame.K_SPACE] and self.on_ground and not self.spin_charge:
+            self.ysp = JUMP_POWER
             self.on_ground = False
+            self.events.append('jump')
 
         # Gravity
-        self.vy += GRAVITY
-        if self.vy > 15:
-            self.vy = 15
+        self.ysp = min(self.ysp + GRAVITY, MAX_FALL_SPEED)
 
-        # Move horizontally and check collisions
-        self.rect.x += self.vx
-        self.collide(self.vx, 0, tiles)
+        # Move horizontally and check the walls; a collision snaps the
+        # position to the pixel the hitbox was pushed back to
+        old_x = self.rect.x
+        self.xpos += self.xsp
+        self.rect.x = self.xpos >> SUBPIXEL_SHIFT
+        if self.rect.x != old_x:
+            self.collide_walls(self.rect.x - old_x, terrain)
+        if self.rect.x != self.xpos >> SUBPIXEL_SHIFT:
+            self.xpos = self.rect.x << SUBPIXEL_SHIFT
 
-        # Move vertically and check collisions
-        self.rect.y += self.vy
+        # Move vertically: the head sensors check the ceiling going up, the
+        # feet sensors find the floor otherwise
+        self.ypos += self.ysp
+        self.rect.y = self.ypos >> SUBPIXEL_SHIFT
         self.on_ground = False
-        self.collide(0, self.vy, tiles)
+        self.angle = 0
+        if self.ysp < 0:
+            self.collide_ceiling(terrain)
+        else:
+            self.find_floor(terrain, was_on_ground)
+        if self.rect.y != self.ypos >> SUBPIXEL_SHIFT:
+            # Resting on the floor keeps the last sub-pixel of the row, so
+            # the next frame's gravity reaches the ground again and the
+            # player stays grounded
+            self.ypos = (self.rect.y << SUBPIXEL_SHIFT) + (SUBPIXEL - 1 if self.on_ground else 0)
+        if self.on_ground and not was_on_ground:
+            self.events.append('land')
 
         # Collect rings
         collected = []
@@ -264,11 +602,13 @@ class Player:
                 collected.append(ring)
         for ring in collected:
             rings.remove(ring)
+            self.ring_count += 1
+            self.events.append('ring')
 
         # --- Animation Logic ---
-        if not self.on_ground:
+        if not self.on_ground or self.spin_charge:
             self.state = 'jump'
-        elif abs(self.vx) > 1.0:
+        elif abs(self.xsp) > SUBPIXEL:
             self.state = 'run'
         else:
             self.state = 'idle'
@@ -286,26 +626,64 @@ class Player:
 
         # Speed up animation if running fast
         if self.state == 'run':
-            self.animation_speed = max(2, 8 - int(abs(self.vx)))
+            self.animation_speed = max(2, 8 - (abs(self.xsp) >> SUBPIXEL_SHIFT))
         else:
             self.animation_speed = 8
 
-    def collide(self, dx, dy, tiles):
-        for tile in tiles:
-            if self.rect.colliderect(tile.rect):
-                if dx > 0:
-                    self.rect.right = tile.rect.left
-                if dx < 0:
-                    self.rect.left = tile.rect.right
-                if dy > 0:
-                    self.rect.bottom = tile.rect.top
-                    self.vy = 0
-                    self.on_ground = True
-                if dy < 0:
-                    self.rect.top = tile.rect.bottom
-                    self.vy = 0
+    def collide_walls(self, dx, terrain):
+        """Backs the hitbox out of walls after moving dx pixels.
 
-    def draw(self, screen, camera_x):
+        The wall sensor runs down the leading edge to just above the feet,
+        so slopes are climbed rather than bumped into. A grounded player
+        climbs no higher than it moved forward (a 45 degree slope), so
+        steeper curves stop it like walls; in the air it can step up to
+        STEP_HEIGHT onto a ledge.
+        """
+        rect = self.rect
+        step = -1 if dx > 0 else 1
+        while dx:
+            climb = min(abs(dx), STEP_HEIGHT) if self.on_ground else STEP_HEIGHT
+            x = rect.right - 1 if dx > 0 else rect.left
+            if not terrain.wall(x, rect.top, rect.bottom - climb):
+                return
+            rect.x += step
+            dx += step
+
+    def collide_ceiling(self, terrain):
+        """Stops a rising player at the bottom of the cell its head hit."""
+        rect = self.rect
+        if terrain.solid_at(rect.left, rect.top) or terrain.solid_at(rect.right - 1, rect.top):
+            rect.top = (rect.top // TILE_SIZE + 1) * TILE_SIZE
+            self.ysp = 0
+
+    def find_floor(self, terrain, was_on_ground):
+        """Stands the player on the ground under either side of the hitbox.
+
+        The higher of the two feet sensors wins. Ground more than
+        STEP_HEIGHT above the feet is a wall, not a floor. A player already
+        on the ground sticks to it down to STEP_HEIGHT below the feet, so
+        running downhill does not turn into a string of short falls.
+        """
+        rect = self.rect
+        highest = rect.bottom - STEP_HEIGHT
+        lowest = rect.bottom + (STEP_HEIGHT if was_on_ground else 0)
+        best = None
+        for x in (rect.left, rect.right - 1):
+            found = terrain.floor(x, rect.bottom)
+            if found and highest <= found[0] <= lowest and (best is None or found[0] < best[0]):
+                best = found
+        if best is None:
+            return
+        rect.bottom, self.angle = best
+        self.ysp = 0
+        self.on_ground = True
+
+    def current_area(self):
+        """The sprite sheet rect for the current state and facing."""
+        frames = self.sprites[self.state] if self.facing_right else self.flipped_sprites[self.state]
+        return frames[self.frame_index % len(frames)]
+
+    def draw_pos(self, camera_x):
         screen_x = self.rect.x - camera_x
         screen_y = self.rect.y
         
@@ -313,24 +691,195 @@ class Player:
         # Center the sprite horizontally over the rect
         draw_x = screen_x - (32 - self.rect.width) // 2
         draw_y = screen_y - (32 - self.rect.height) # Draw feet at bottom of rect
+        return draw_x, draw_y
 
-        # Get current frame
-        frames = self.sprites[self.state]
-        current_image = frames[self.frame_index % len(frames)]
+    def draw(self, screen, camera_x):
+        screen.blit(self.sprite_sheet(), self.draw_pos(camera_x), self.current_area())
+
+# ----------------------------------------------------------------------
+# Terrain collision
+#
+# Every tile shape has a height array (how many pixels of each of its
+# TILE_SIZE columns are solid, counted up from the tile bottom) and an angle
+# array (the surface angle over each column). Both are built once, at
+# import, into one small table per shape. The level keeps one shape id byte
+# per cell, so a sensor finds the floor under a pixel column with a cell
+# lookup and a table lookup, whatever the size of the level.
+
+TILE_SHAPE_IDS = {char: index + 1 for index, char in enumerate(TILE_SHAPES)}
+
+
+def _shape_heights(char):
+    x = np.arange(TILE_SIZE)
+    half = TILE_SIZE // 2
+    if char == '1':
+        heights = np.full(TILE_SIZE, TILE_SIZE)
+    elif char == '/':
+        heights = x + 1
+    elif char == '\\':
+        heights = TILE_SIZE - x
+    elif char == 'a':
+        heights = (x + 1) // 2
+    elif char == 'b':
+        heights = half + (x + 1) // 2
+    elif char == 'c':
+        heights = TILE_SIZE - x // 2
+    elif char == 'd':
+        heights = half - x // 2
+    else:
+        # Quarter circle of radius TILE_SIZE, rising to the right for ')'
+        heights = np.rint(TILE_SIZE - np.sqrt(TILE_SIZE**2 - (x + 1.0)**2)).astype(int)
+        if char == '(':
+            heights = heights[::-1]
+    return heights
+
+
+def _build_terrain_tables():
+    """(heights, angles): a bytes of TILE_SIZE columns per shape id.
+
+    Angles are byte angles (256 to the turn, counterclockwise), so a slope
+    rising to the right is 32 and one falling to the right 224.
+    """
+    heights, angles = [bytes(TILE_SIZE)], [bytes(TILE_SIZE)]
+    for char in TILE_SHAPES:
+        column_heights = _shape_heights(char)
+        # Slope across a 4 pixel span around each column, kept inside the
+        # tile, so the pixel steps of gentle slopes average out
+        left = np.clip(np.arange(TILE_SIZE) - 2, 0, TILE_SIZE - 5)
+        rise = (column_heights[left + 4] - column_heights[left]) / 4
+        column_angles = np.rint(np.arctan(rise) * 128 / math.pi).astype(int) & 255
+        heights.append(bytes(column_heights.astype(np.uint8)))
+        angles.append(bytes(column_angles.astype(np.uint8)))
+    return heights, angles
+
+
+TILE_HEIGHTS, TILE_ANGLES = _build_terrain_tables()
+# The height tables as one (shapes, TILE_SIZE) array, for vectorized lookups
+TILE_HEIGHT_GRID = np.frombuffer(b"".join(TILE_HEIGHTS), np.uint8).reshape(-1, TILE_SIZE)
+# Sine of each byte angle, in 1/SUBPIXEL units
+SINE = [round(math.sin(angle * math.pi / 128) * SUBPIXEL) for angle in range(256)]
+
+
+def build_shape_grid(map_data):
+    """uint8 (rows, cols) array of the shape id of every cell."""
+    lookup = np.zeros(256, np.uint8)
+    for char, shape in TILE_SHAPE_IDS.items():
+        lookup[ord(char)] = shape
+    grid = np.frombuffer("".join(map_data).encode("ascii"), dtype=np.uint8)
+    return lookup[grid].reshape(len(map_data), -1)
+
+
+class Terrain:
+    """A level's shape ids, one byte per cell, answering the player's sensors.
+
+    cells holds the ids row by row; grid is a (rows, cols) NumPy view of
+    the same bytes for whole-level work.
+    """
+
+    def __init__(self, map_data):
+        self.cells = bytearray(build_shape_grid(map_data).tobytes())
+        self.cols = len(map_data[0])
+        self.rows = len(map_data)
+        self._view()
+
+    def _view(self):
+        self.width = self.cols * TILE_SIZE
+        self.grid = np.frombuffer(self.cells, np.uint8).reshape(self.rows, self.cols)
+
+    def copy(self):
+        other = copy.copy(self)
+        other.cells = bytearray(self.cells)
+        other._view()
+        return other
+
+    def set(self, col, row, char):
+        self.cells[row * self.cols + col] = TILE_SHAPE_IDS.get(char, 0)
+
+    def _shape(self, col, row):
+        # Columns beyond the sides of the level are solid all the way up,
+        # so the level edges are walls
+        if not 0 <= col < self.cols:
+            return 1
+        if 0 <= row < self.rows:
+            return self.cells[row * self.cols + col]
+        return 0
+
+    def floor(self, x, y):
+        """(surface y, angle) of the ground in pixel column x around y, or None.
+
+        Looks in the cell holding y, then in the cell above if that column
+        is full or the cell below if it is empty, so ground from the top of
+        the cell above y to the bottom of the cell below is found.
+        """
+        col, column = divmod(x, TILE_SIZE)
+        row = y // TILE_SIZE
+        shape = self._shape(col, row)
+        height = TILE_HEIGHTS[shape][column]
+        if height == TILE_SIZE:
+            above = self._shape(col, row - 1)
+            if TILE_HEIGHTS[above][column]:
+                row, shape = row - 1, above
+        elif not height:
+            row += 1
+            shape = self._shape(col, row)
+            if not TILE_HEIGHTS[shape][column]:
+                return None
+        return (row + 1) * TILE_SIZE - TILE_HEIGHTS[shape][column], TILE_ANGLES[shape][column]
+
+    def wall(self, x, top, bottom):
+        """Whether any ground in pixel column x lies between rows top and bottom."""
+        if bottom <= top:
+            return False
+        col, column = divmod(x, TILE_SIZE)
+        for row in range(top // TILE_SIZE, (bottom - 1) // TILE_SIZE + 1):
+            height = TILE_HEIGHTS[self._shape(col, row)][column]
+            if height and (row + 1) * TILE_SIZE - height < bottom:
+                return True
+        return False
+
+    def solid_at(self, x, y):
+        """Whether pixel (x, y) is inside the ground."""
+        col, column = divmod(x, TILE_SIZE)
+        row = y // TILE_SIZE
+        height = TILE_HEIGHTS[self._shape(col, row)][column]
+        return height != 0 and y >= (row + 1) * TILE_SIZE - height
 
-        if self.facing_right:
-            screen.blit(current_image, (draw_x, draw_y))
-        else:
-            # Flip horizontally if facing left
-            flipped_asset = pygame.transform.flip(current_image, True, False)
-            screen.blit(flipped_asset, (draw_x, draw_y))
 
 # ----------------------------------------------------------------------
 class Tile:
-    def __init__(self, x, y):
+    def __init__(self, x, y, shape=1):
         self.rect = pygame.Rect(x, y, TILE_SIZE, TILE_SIZE)
+        self.shape = shape
+
+    @staticmethod
+    def get_image(shape=1):
+        """Returns the shared surface of a tile shape; its top TUFT_HEIGHT rows hold the grass tufts."""
+        return surface_cache.get(('tile', shape), functools.partial(Tile._bake_image, shape))
+
+    @staticmethod
+    def _bake_image(shape):
+        image = pygame.Surface((TILE_SIZE, TILE_SIZE + TUFT_HEIGHT), pygame.SRCALPHA)
+        if shape == 1:
+            Tile(0, TUFT_HEIGHT).draw(image, 0)
+            return image
+        # Slopes are drawn a pixel column at a time from the height table,
+        # with the grass edge following the surface
+        bottom = TILE_SIZE + TUFT_HEIGHT
+        for x, height in enumerate(TILE_HEIGHTS[shape]):
+            if not height:
+                continue
+            pygame.draw.line(image, GROUND_COLOR, (x, bottom - height), (x, bottom - 1))
+            pygame.draw.line(image, GROUND_STRIPE, (x, max(bottom - height, bottom - 4)),
+                             (x, bottom - 1))
+            pygame.draw.line(image, (50, 150, 50), (x, bottom - height - 2),
+                             (x, bottom - height))
+        return image
 
     def draw(self, screen, camera_x):
+        if self.shape != 1:
+            screen.blit(Tile.get_image(self.shape),
+                        (self.rect.x - camera_x, self.rect.y - TUFT_HEIGHT))
+            return
         screen_rect = self.rect.copy()
         screen_rect.x -= camera_x
         pygame.draw.rect(screen, GROUND_COLOR, screen_rect)
@@ -342,38 +891,583 @@ class Tile:
             y = screen_rect.y
             pygame.draw.line(screen, (50, 150, 50), (x, y), (x+4, y-4), 2)
 
+# ----------------------------------------------------------------------
+def _ring_frame_areas():
+    """The strip rect of each ring spin frame, left to right."""
+    size = TILE_SIZE//2 + 1
+    return [pygame.Rect(i * size, 0, size, size) for i in range(RING_FRAMES)]
+
+
+def _bake_ring_frames():
+    """Pre-renders the ring spin into one strip laid out as _ring_frame_areas().
+
+    Every ring blits its frame out of this single colourkeyed, RLE-encoded
+    strip, so the pixels are shared and transparent runs cost nothing.
+    """
+    size = TILE_SIZE//2 + 1
+    center = size // 2
+    strip = pygame.Surface((size * RING_FRAMES, size))
+    strip.fill(RING_COLORKEY)
+    for i, area in enumerate(_ring_frame_areas()):
+        frame = strip.subsurface(area)
+        # Half a turn is enough: the ring looks the same from behind
+        squash = abs(math.cos(i * math.pi / RING_FRAMES))
+        if i == 0:
+            pygame.draw.circle(frame, RING_MAIN, (center, center), TILE_SIZE//4)
+            pygame.draw.circle(frame, RING_HOLE, (center, center), TILE_SIZE//6)
+        else:
+            outer_w = max(2, round((TILE_SIZE//2) * squash))
+            pygame.draw.ellipse(frame, RING_MAIN, (center - outer_w // 2, 0, outer_w, size - 1))
+            hole_w = round((TILE_SIZE//3) * squash)
+            if hole_w >= 2:
+                pygame.draw.ellipse(frame, RING_HOLE, (center - hole_w // 2, 3, hole_w, size - 7))
+        pygame.draw.line(frame, RING_SHINE, (center - 1, 2), (center - 1, 3))
+    del frame  # A live subsurface would keep the strip from being RLE-encoded
+    strip.set_colorkey(RING_COLORKEY, pygame.RLEACCEL)
+    return strip
+
 # ----------------------------------------------------------------------
 class Ring:
+    # Every ring shows a frame of one spin animation strip, baked on first use
+    frame_areas = _ring_frame_areas()
+
     def __init__(self, x, y):
         self.rect = pygame.Rect(x, y, TILE_SIZE//2, TILE_SIZE//2)
 
+    @staticmethod
+    def get_strip():
+        return surface_cache.get('ring-strip', _bake_ring_frames)
+
+    @classmethod
+    def frame_area(cls, ticks):
+        """The strip rect every ring shows at ticks: one global animation clock."""
+        return cls.frame_areas[ticks // RING_FRAME_MS % RING_FRAMES]
+
+    def draw(self, screen, camera_x, ticks=None, strip=None):
+        """Blits the ring; pass the frame's get_strip() as strip when drawing many."""
+        if ticks is None:
+            ticks = pygame.time.get_ticks()
+        if strip is None:
+            strip = self.get_strip()
+        screen.blit(strip, (self.rect.x - camera_x, self.rect.y), self.frame_area(ticks))
+
+# ----------------------------------------------------------------------
+def _bake_particle(kind):
+    """Pre-renders the small surface particles of kind are drawn with."""
+    if kind == PARTICLE_RING:
+        ring = pygame.Surface((8, 8), pygame.SRCALPHA)
+        pygame.draw.circle(ring, RING_MAIN, (4, 4), 4)
+        pygame.draw.circle(ring, (0, 0, 0, 0), (4, 4), 2)
+        return ring
+    if kind == PARTICLE_DUST:
+        dust = pygame.Surface((6, 6), pygame.SRCALPHA)
+        pygame.draw.circle(dust, (235, 235, 225, 170), (3, 3), 3)
+        return dust
+    spark = pygame.Surface((4, 4), pygame.SRCALPHA)
+    spark.fill((255, 255, 200, 220))
+    return spark
+
+
+class ParticlePool:
+    """Fixed-capacity particle system stored as parallel NumPy arrays.
+
+    Particles are never allocated individually: emitting claims the next
+    slots of a ring buffer (recycling the oldest particles when the pool is
+    full), and update/draw work on whole arrays at once.
+    """
+
+    def __init__(self, capacity=MAX_PARTICLES):
+        self.capacity = capacity
+        self.pos = np.zeros((capacity, 2), dtype=np.float32)
+        self.vel = np.zeros((capacity, 2), dtype=np.float32)
+        self.life = np.zeros(capacity, dtype=np.int16)
+        self.kind = np.zeros(capacity, dtype=np.uint8)
+        self.cursor = 0
+        self.rng = np.random.default_rng()
+
+        # Sprites are drawn centred on the particle position
+        self.offsets = [(s.get_width() // 2, s.get_height() // 2) for s in self.sprites()]
+
+    @staticmethod
+    def sprites():
+        """One surface per particle kind, indexed by kind."""
+        return [surface_cache.get(('particle', kind), functools.partial(_bake_particle, kind))
+                for kind in (PARTICLE_RING, PARTICLE_DUST, PARTICLE_SPARK)]
+
+    def emit(self, kind, x, y, vx, vy, life):
+        """Spawns one particle per element of vx/vy at (x, y)."""
+        vx, vy = np.broadcast_arrays(np.atleast_1d(vx), np.atleast_1d(vy))
+        n = min(len(vx), self.capacity)
+        slots = (self.cursor + np.arange(n)) % self.capacity
+        self.cursor = (self.cursor + n) % self.capacity
+
+        self.pos[slots] = (x, y)
+        self.vel[slots, 0] = vx[:n]
+        self.vel[slots, 1] = vy[:n]
+        self.life[slots] = life
+        self.kind[slots] = kind
+
+    def ring_scatter(self, x, y, count):
+        """Classic ring loss: rings fan out in two arcs, inner ring slower."""
+        angles = np.linspace(np.pi / 8, np.pi * 7 / 8, count)
+        speed = np.where(np.arange(count) % 2, 2.0, 4.0)
+        self.emit(PARTICLE_RING, x, y, np.cos(angles) * speed, -np.sin(angles) * speed, 256)
+
+    def dust(self, x, y, count=6):
+        """Puff of dust at the player's feet."""
+        vx = self.rng.uniform(-1.5, 1.5, count)
+        vy = self.rng.uniform(-0.8, -0.2, count)
+        self.emit(PARTICLE_DUST, x, y, vx, vy, 18)
+
+    def spin_dash(self, x, y, facing_right, count=3):
+        """Sparks kicked up behind a revving spin dash."""
+        direction = -1 if facing_right else 1
+        vx = direction * self.rng.uniform(1.0, 3.0, count)
+        vy = self.rng.uniform(-2.5, -0.5, count)
+        self.emit(PARTICLE_SPARK, x, y, vx, vy, 20)
+
+    def update(self, terrain):
+        """Integrates gravity and bounces live particles off the terrain."""
+        live = self.life > 0
+        if not live.any():
+            return
+        kind = self.kind
+        pos = self.pos
+        vel = self.vel
+
+        vel[:, 1] += PARTICLE_GRAVITY[kind] * live
+
+        # Axis-separated moves so particles slide along walls and floors
+        new_x = pos[:, 0] + vel[:, 0]
+        hit = live & _solid_at(terrain, new_x, pos[:, 1])
+        vel[hit, 0] *= -PARTICLE_BOUNCE[kind[hit]]
+        pos[:, 0] = np.where(hit, pos[:, 0], new_x)
+
+        new_y = pos[:, 1] + vel[:, 1]
+        hit = live & _solid_at(terrain, pos[:, 0], new_y)
+        vel[hit, 1] *= -PARTICLE_BOUNCE[kind[hit]]
+        pos[:, 1] = np.where(hit, pos[:, 1], new_y)
+
+        self.life[live] -= 1
+
+    def blit_items(self, camera_x):
+        """(surface, position) pairs for every live particle."""
+        idx = np.flatnonzero(self.life > 0)
+        if not len(idx):
+            return []
+        xs = (self.pos[idx, 0] - camera_x).astype(np.int32).tolist()
+        ys = self.pos[idx, 1].astype(np.int32).tolist()
+        sprites = self.sprites()
+        offsets = self.offsets
+        return [(sprites[k], (x - offsets[k][0], y - offsets[k][1]))
+                for k, x, y in zip(self.kind[idx].tolist(), xs, ys)]
+
     def draw(self, screen, camera_x):
-        screen_rect = self.rect.copy()
-        screen_rect.x -= camera_x
-        center = screen_rect.center
-        pygame.draw.circle(screen, RING_MAIN, center, TILE_SIZE//4)
-        pygame.draw.circle(screen, RING_HOLE, center, TILE_SIZE//6)
+        screen.blits(self.blit_items(camera_x), doreturn=False)
+
+
+def _solid_at(terrain, x, y):
+    """Vectorized ground lookup for pixel coordinates, by the terrain's height tables.
+
+    The left and right level edges act as walls; above and below the map
+    is open space.
+    """
+    x = np.floor(x).astype(np.int32)
+    y = np.floor(y).astype(np.int32)
+    rows = y // TILE_SIZE
+    cols = x // TILE_SIZE
+    grid = terrain.grid
+    result = (cols < 0) | (cols >= grid.shape[1])
+    inside = ~result & (rows >= 0) & (rows < grid.shape[0])
+    rows, cols = rows[inside], cols[inside]
+    heights = TILE_HEIGHT_GRID[grid[rows, cols], x[inside] - cols * TILE_SIZE]
+    result[inside] = y[inside] >= (rows + 1) * TILE_SIZE - heights
+    return result
+
+# ----------------------------------------------------------------------
+def _sweep(rate, duration, freq_start, freq_end, square=False, decay=0.0):
+    """A tone gliding from freq_start to freq_end with exponential decay."""
+    t = np.arange(int(rate * duration)) / rate
+    freq = np.linspace(freq_start, freq_end, len(t))
+    wave = np.sin(2 * np.pi * np.cumsum(freq) / rate)
+    if square:
+        wave = np.sign(wave)
+    return wave * np.exp(-decay * t)
+
+
+def _synthesize_effects(rate):
+    """Float waveforms in [-1, 1] for every sound effect."""
+    ring = _sweep(rate, 0.3, 1568, 1568, decay=9)
+    # Classic two-note chime: the higher note joins 60 ms in
+    chime = _sweep(rate, 0.24, 2093, 2093, decay=11)
+    ring[-len(chime):] += chime
+
+    rng = np.random.default_rng(7)
+    rev = _sweep(rate, 0.18, 220, 1100, square=True, decay=6)
+    rev += rng.uniform(-0.3, 0.3, len(rev)) * np.linspace(0, 1, len(rev))
+    dash = rng.uniform(-1, 1, int(rate * 0.22)) * np.exp(-14 * np.arange(int(rate * 0.22)) / rate)
+    dash += _sweep(rate, 0.22, 900, 150, square=True, decay=10) * 0.5
+
+    return {
+        'ring': ring * 0.5,
+        'jump': _sweep(rate, 0.16, 320, 960, square=True, decay=8) * 0.35,
+        'spin': rev * 0.35,
+        'dash': dash * 0.4,
+    }
+
+
+class AudioSystem:
+    """Sound effects synthesized once and played on a fixed pool of voices.
+
+    The mixer runs with a small buffer for low latency. Every effect is
+    rendered once into a NumPy buffer and wrapped in a Sound object up
+    front, so play() only picks a channel: an idle one if there is one,
+    otherwise it steals the voice that started longest ago.
+    """
+
+    def __init__(self, voices=AUDIO_VOICES):
+        self.enabled = False
+        try:
+            pygame.mixer.init(AUDIO_RATE, -16, 1, AUDIO_BUFFER)
+        except pygame.error:
+            return  # No audio device: play() is a no-op
+        self.enabled = True
+        rate, _, out_channels = pygame.mixer.get_init()
+
+        pygame.mixer.set_num_channels(voices)
+        self.voices = [pygame.mixer.Channel(i) for i in range(voices)]
+        self.started = [0] * voices
+        self.plays = 0
+
+        self.sounds = {}
+        for name, wave in _synthesize_effects(rate).items():
+            samples = (np.clip(wave, -1, 1) * 32767).astype(np.int16)
+            if out_channels > 1:
+                samples = np.repeat(samples[:, None], out_channels, axis=1)
+            self.sounds[name] = pygame.sndarray.make_sound(np.ascontiguousarray(samples))
+
+    def play(self, name):
+        if not self.enabled:
+            return
+        voices = self.voices
+        index = 0
+        for i, channel in enumerate(voices):
+            if not channel.get_busy():
+                index = i
+                break
+            if self.started[i] < self.started[index]:
+                index = i
+        self.plays += 1
+        self.started[index] = self.plays
+        voices[index].play(self.sounds[name])
+
+
+# Sound effect played for each Player event
+EVENT_SOUNDS = {
+    'jump': 'jump',
+    'ring': 'ring',
+    'spin_start': 'spin',
+    'spin_release': 'dash',
+}
+
+_audio = None
+
+def get_audio():
+    """Returns the shared AudioSystem, starting the mixer on first use."""
+    global _audio
+    if _audio is None:
+        _audio = AudioSystem()
+    return _audio
+
+# ----------------------------------------------------------------------
+class DrawList:
+    """Collects (surface, position[, area]) items per layer for batched submission.
+
+    Each layer is handed to SDL in a single Surface.fblits/blits call, so a
+    frame costs one Python-to-C round trip per layer instead of one (or
+    several) per object.
+    """
+
+    def __init__(self):
+        self.layers = {}
+
+    def add(self, layer, surface, pos, area=None):
+        item = (surface, pos) if area is None else (surface, pos, area)
+        self.layers.setdefault(layer, []).append(item)
+
+    def extend(self, layer, items):
+        self.layers.setdefault(layer, []).extend(items)
+
+    def submit(self, screen):
+        """Blits every layer back to front and empties the list for the next frame."""
+        for layer in sorted(self.layers):
+            items = self.layers[layer]
+            if not items:
+                continue
+            # fblits only takes (surface, position); layers blitting out of a
+            # sprite strip carry an area rect and go through blits
+            if HAS_FBLITS and len(items[0]) == 2:
+                screen.fblits(items)
+            else:
+                screen.blits(items, doreturn=False)
+            items.clear()
+
+
+# pygame-ce's fblits skips building the list of dirty rects entirely
+HAS_FBLITS = hasattr(pygame.Surface, 'fblits')
+
+
+def queue_world(draw_list, level, rings, player, particles, camera_x, ticks=0,
+                view_width=SCREEN_WIDTH):
+    """Queues every world object visible in a view_width wide view into draw_list."""
+    cam = int(camera_x)
+    left = cam - TILE_SIZE
+    right = cam + view_width
+
+    draw_list.extend(LAYER_TILES, level.blit_items(cam, view_width))
+
+    ring_strip = Ring.get_strip()
+    ring_area = Ring.frame_area(ticks)
+    draw_list.extend(LAYER_RINGS, [
+        (ring_strip, (ring.rect.x - cam, ring.rect.y), ring_area)
+        for ring in rings if left < ring.rect.x < right
+    ])
+
+    draw_list.add(LAYER_PLAYER, Player.sprite_sheet(), player.draw_pos(cam), player.current_area())
+    if particles is not None:
+        draw_list.extend(LAYER_PARTICLES, particles.blit_items(cam))
+
+# ----------------------------------------------------------------------
+class TextureRenderer:
+    """Composes frames from textures on an SDL2 Renderer instead of surface blits.
+
+    Every surface a draw list names (level chunks, backdrop strips, sprite
+    sheets) is uploaded as a texture the first time it is drawn, so a frame
+    is just texture copies.  A scaled window gets the frame composed at
+    SCREEN_WIDTH x SCREEN_HEIGHT in a target texture and stretched in one
+    final copy; scaling every copy instead costs the software renderer
+    four times as much.  Screens still painted onto a surface (menu,
+    loading bar) are uploaded whole once per frame by flip().
+    """
+
+    def __init__(self, title, scale=1, accelerated=False):
+        if sdl2_video is None:
+            raise SystemExit("this pygame has no pygame._sdl2.video; use --renderer surface")
+        self.window = sdl2_video.Window(title, (SCREEN_WIDTH * scale, SCREEN_HEIGHT * scale))
+        # The software renderer needs no GPU; it rasterises into the window surface
+        self.renderer = sdl2_video.Renderer(self.window, accelerated=int(accelerated),
+                                            target_texture=scale != 1)
+        self.frame = None
+        if scale != 1:
+            self.frame = sdl2_video.Texture(self.renderer, (SCREEN_WIDTH, SCREEN_HEIGHT),
+                                            target=True)
+            self.renderer.target = self.frame
+        # A surface evicted from surface_cache takes its texture with it
+        self.textures = weakref.WeakKeyDictionary()
+        # Palette swaps recolour the sprite sheet in place: one texture per palette
+        self.sheet_textures = {}
+        self.screen_texture = None
+
+    def texture(self, surface):
+        if surface is surface_cache.peek(Player.SHEET_KEY):
+            textures, key = self.sheet_textures, Player.palette
+        else:
+            textures, key = self.textures, surface
+        texture = textures.get(key)
+        if texture is None:
+            texture = textures[key] = sdl2_video.Texture.from_surface(self.renderer, surface)
+        return texture
+
+    def submit(self, draw_list, rect=None):
+        """Copies every layer of draw_list into rect (default: the whole frame) and empties it."""
+        self.renderer.set_viewport(rect)
+        texture = self.texture
+        for layer in sorted(draw_list.layers):
+            items = draw_list.layers[layer]
+            for item in items:
+                if len(item) == 2:
+                    texture(item[0]).draw(None, item[1])
+                else:
+                    # A bare position would stretch the whole texture into the area's size
+                    surface, (x, y), area = item
+                    texture(surface).draw(area, (x, y, area[2], area[3]))
+            items.clear()
+        self.renderer.set_viewport(None)
+
+    def fill(self, color, rect):
+        self.renderer.draw_color = pygame.Color(color)
+        self.renderer.fill_rect(rect)
+
+    def present(self):
+        if self.frame:
+            self.renderer.target = None
+            self.frame.draw()
+        self.renderer.present()
+        self.renderer.target = self.frame
+
+    def flip(self, screen):
+        """Shows a frame that was drawn onto the surface screen."""
+        if self.screen_texture is None:
+            self.screen_texture = sdl2_video.Texture(self.renderer, screen.get_size(),
+                                                     streaming=True)
+        self.screen_texture.update(screen)
+        self.renderer.target = None
+        self.screen_texture.draw()
+        self.renderer.present()
+        self.renderer.target = self.frame
+
+    def read(self, screen):
+        """Copies the frame being composed into screen (slow; for recording only)."""
+        self.renderer.to_surface(screen, screen.get_rect())
+
+    def close(self):
+        # Textures must go before the renderer they belong to
+        self.textures.clear()
+        self.sheet_textures.clear()
+        self.screen_texture = self.frame = None
+        self.renderer = None
+        self.window.destroy()
+
 
 # ----------------------------------------------------------------------
-def draw_sky(screen):
-    """Gradient sky with clouds."""
+class ParallaxLayer:
+    """A baked, horizontally tiling strip scrolled at a fraction of the camera.
+
+    The strip is at least as wide as the screen, so any scroll offset is
+    covered by at most two blits however detailed the strip is.  It lives
+    in surface_cache under key and bake() must rebuild it identically.
+    """
+
+    def __init__(self, key, bake, factor, y=0, drift=0.0):
+        self.key = key
+        self.bake = bake
+        self.factor = factor
+        self.y = y
+        self.drift = drift  # Extra scroll in pixels per millisecond (clouds)
+
+    @property
+    def surface(self):
+        return surface_cache.get(self.key, self.bake)
+
+    def blit_items(self, camera_x, ticks, view_width=SCREEN_WIDTH):
+        surface = self.surface
+        width = surface.get_width()
+        x = -(int(camera_x * self.factor - ticks * self.drift) % width)
+        items = [(surface, (x, self.y))]
+        if x + width < view_width:
+            items.append((surface, (x + width, self.y)))
+        return items
+
+
+def _wrapped(width, x, draw):
+    """Calls draw at x and one strip-width either side so shapes wrap seamlessly."""
+    for dx in (-width, 0, width):
+        draw(x + dx)
+
+
+def _bake_sky():
+    """Vertical gradient covering the whole screen."""
+    sky = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
     for y in range(SCREEN_HEIGHT):
         ratio = y / SCREEN_HEIGHT
         r = int(SKY_TOP[0] * (1-ratio) + SKY_BOTTOM[0] * ratio)
         g = int(SKY_TOP[1] * (1-ratio) + SKY_BOTTOM[1] * ratio)
         b = int(SKY_TOP[2] * (1-ratio) + SKY_BOTTOM[2] * ratio)
-        pygame.draw.line(screen, (r, g, b), (0, y), (SCREEN_WIDTH, y))
+        pygame.draw.line(sky, (r, g, b), (0, y), (SCREEN_WIDTH, y))
+    return sky
 
-    # Draw some clouds
-    cloud_color = (255, 255, 255, 180)
-    random.seed(42) # Consistent clouds
+
+def _bake_clouds(rng):
+    surf = pygame.Surface((PARALLAX_WIDTH, 180), pygame.SRCALPHA)
     for _ in range(8):
-        x = (pygame.time.get_ticks() // 100 + random.randint(0, 600)) % 800 - 100
-        y = random.randint(20, 150)
-        pygame.draw.circle(screen, cloud_color, (x, y), 30)
-        pygame.draw.circle(screen, cloud_color, (x+30, y-10), 25)
-        pygame.draw.circle(screen, cloud_color, (x-20, y-5), 20)
-    random.seed()
+        cx = rng.randint(0, PARALLAX_WIDTH)
+        cy = rng.randint(40, 150)
+
+        def cloud(x):
+            pygame.draw.circle(surf, CLOUD_COLOR, (x, cy), 30)
+            pygame.draw.circle(surf, CLOUD_COLOR, (x+30, cy-10), 25)
+            pygame.draw.circle(surf, CLOUD_COLOR, (x-20, cy-5), 20)
+        _wrapped(PARALLAX_WIDTH, cx, cloud)
+    return surf
+
+
+def _bake_mountains(rng):
+    height = 150
+    surf = pygame.Surface((PARALLAX_WIDTH, height), pygame.SRCALPHA)
+    # Far range first, then the nearer green hills with a lighter ridge line
+    for color, count, peak in ((MOUNTAIN_FAR, 7, (10, 60)), (MOUNTAIN_NEAR, 9, (50, 100))):
+        for _ in range(count):
+            cx = rng.randint(0, PARALLAX_WIDTH)
+            half = rng.randint(60, 120)
+            top = rng.randint(*peak)
+
+            def mountain(x):
+                pygame.draw.polygon(surf, color, [(x - half, height), (x, top), (x + half, height)])
+                if color == MOUNTAIN_NEAR:
+                    pygame.draw.line(surf, MOUNTAIN_RIDGE, (x - half // 3, top + 25), (x, top), 3)
+            _wrapped(PARALLAX_WIDTH, cx, mountain)
+    return surf
+
+
+def _bake_water(rng):
+    height = SCREEN_HEIGHT - 270
+    surf = pygame.Surface((PARALLAX_WIDTH, height))
+    surf.fill(WATER_COLOR)
+    for _ in range(60):
+        x = rng.randint(0, PARALLAX_WIDTH)
+        y = rng.randint(2, height - 2)
+        length = rng.randint(8, 40)
+
+        def shine(x):
+            pygame.draw.line(surf, WATER_SHINE, (x, y), (x + length, y))
+        _wrapped(PARALLAX_WIDTH, x, shine)
+    return surf
+
+
+def _bake_foliage(rng):
+    height = 70
+    surf = pygame.Surface((PARALLAX_WIDTH, height), pygame.SRCALPHA)
+    for color, count in ((FOLIAGE_DARK, 24), (FOLIAGE_LIGHT, 16)):
+        for _ in range(count):
+            cx = rng.randint(0, PARALLAX_WIDTH)
+            w = rng.randint(40, 90)
+            h = rng.randint(25, 55)
+
+            def bush(x):
+                pygame.draw.ellipse(surf, color, (x - w // 2, height - h, w, h * 2))
+            _wrapped(PARALLAX_WIDTH, cx, bush)
+    return surf
+
+
+def _seeded(bake, seed):
+    """bake(rng) with a fresh generator each call, so every re-bake matches the first."""
+    return lambda: bake(random.Random(seed))
+
+
+class ParallaxBackground:
+    """Green Hill backdrop: sky, clouds, mountains, water and foliage."""
+
+    def __init__(self, seed=42):
+        # Same scenery every run; each strip draws from its own generator
+        self.layers = [
+            ParallaxLayer(('sky',), _bake_sky, 0.0),
+            ParallaxLayer(('clouds', seed), _seeded(_bake_clouds, f"{seed}:clouds"),
+                          0.05, y=0, drift=0.01),
+            ParallaxLayer(('mountains', seed), _seeded(_bake_mountains, f"{seed}:mountains"),
+                          0.15, y=140),
+            ParallaxLayer(('water', seed), _seeded(_bake_water, f"{seed}:water"), 0.3, y=270),
+            ParallaxLayer(('foliage', seed), _seeded(_bake_foliage, f"{seed}:foliage"),
+                          0.55, y=SCREEN_HEIGHT - 2*TILE_SIZE - 46),
+        ]
+        # Bake now, not on the first frame drawn
+        for layer in self.layers:
+            layer.surface
+
+    def blit_items(self, camera_x, ticks, view_width=SCREEN_WIDTH):
+        items = []
+        for layer in self.layers:
+            items.extend(layer.blit_items(camera_x, ticks, view_width))
+        return items
 
 # ----------------------------------------------------------------------
 def load_level(map_data):
@@ -381,105 +1475,2412 @@ def load_level(map_data):
     rings = []
     for row_idx, row in enumerate(map_data):
         for col_idx, tile in enumerate(row):
-            if tile == '1':
-                tiles.append(Tile(col_idx * TILE_SIZE, row_idx * TILE_SIZE))
-            # Place rings on specific tiles (just examples)
-            if (row_idx == 5 and col_idx == 40) or (row_idx == 3 and col_idx == 50) or (row_idx == 7 and col_idx == 55):
-                rings.append(Ring(col_idx * TILE_SIZE, row_idx * TILE_SIZE - TILE_SIZE//2))
+            if tile in TILE_SHAPE_IDS:
+                tiles.append(Tile(col_idx * TILE_SIZE, row_idx * TILE_SIZE, TILE_SHAPE_IDS[tile]))
+            elif tile == 'R':
+                rings.append(Ring(col_idx * TILE_SIZE, row_idx * TILE_SIZE + TILE_SIZE//2))
     return tiles, rings
 
-# ----------------------------------------------------------------------
-def main_menu(screen, clock):
-    font = pygame.font.Font(None, 36)
-    options = ["Start Game", "Quit"]
-    selected = 0
+def build_solid_grid(map_data):
+    """Boolean (rows, cols) array of cells holding any tile, for vectorized collision."""
+    return build_shape_grid(map_data) != 0
 
-    while True:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_UP:
-                    selected = (selected - 1) % len(options)
-                elif event.key == pygame.K_DOWN:
-                    selected = (selected + 1) % len(options)
-                elif event.key == pygame.K_RETURN:
-                    if selected == 0:
-                        return PLAYING
-                    elif selected == 1:
-                        pygame.quit()
-                        sys.exit()
+def start_x(columns):
+    """Spawn x for a level this many columns wide; narrow maps pull it inside."""
+    return min(100, (columns - 1) * TILE_SIZE + 2)
 
-        screen.fill(MENU_BG)
 
-        title = font.render("Sonic CD - Green Hill Zone", True, TEXT_COLOR)
-        title_rect = title.get_rect(center=(SCREEN_WIDTH//2, 100))
-        screen.blit(title, title_rect)
+def generate_level(width, height, seed=0, platform_density=0.04, ring_count=20):
+    """Seeded random level in the level_map format, for stress tests.
 
-        for i, opt in enumerate(options):
-            color = SELECTED_COLOR if i == selected else TEXT_COLOR
-            text = font.render(opt, True, color)
-            text_rect = text.get_rect(center=(SCREEN_WIDTH//2, 200 + i*50))
-            screen.blit(text, text_rect)
+    The bottom row is solid ground and the row above it is kept clear so the
+    floor is always walkable. platform_density is the fraction of the open
+    area covered by 2-6 tile floating platforms; rings rest on the ground or
+    on platforms, falling back to open air once the surfaces run out.
+    """
+    if width < 1 or height < 3:
+        raise ValueError("levels need at least 1 column and 3 rows")
+    rng = random.Random(seed)
+    grid = [['0'] * width for _ in range(height)]
+    grid[-1] = ['1'] * width
 
-        pygame.display.flip()
-        clock.tick(FPS)
+    for _ in range(int(width * (height - 2) * platform_density / 4)):
+        length = rng.randint(2, 6)
+        row = rng.randrange(0, height - 2)
+        col = rng.randrange(0, max(1, width - length))
+        grid[row][col:col + length] = ['1'] * min(length, width - col)
+
+    # Keep the start column clear so the player never spawns inside a wall
+    for row in range(height - 1):
+        grid[row][(start_x(width) + 14) // TILE_SIZE] = '0'
+
+    empty = [(row, col) for row in range(height - 1) for col in range(width)
+             if grid[row][col] == '0']
+    rng.shuffle(empty)
+    surfaces = [(row, col) for row, col in empty if grid[row + 1][col] == '1']
+    spots = surfaces[:ring_count]
+    if len(spots) < ring_count:
+        taken = set(spots)
+        spots += [cell for cell in empty if cell not in taken][:ring_count - len(spots)]
+    for row, col in spots:
+        grid[row][col] = 'R'
+    return ["".join(row) for row in grid]
+
+def apply_map_edits(map_data, edits):
+    """A copy of map_data with each (row, col, cells) edit written over it."""
+    rows = list(map_data)
+    for row, col, cells in edits:
+        rows[row] = rows[row][:col] + cells + rows[row][col + len(cells):]
+    return rows
 
 # ----------------------------------------------------------------------
-def play_game(screen, clock):
-    tiles, rings = load_level(level_map)
-    player = Player(100, SCREEN_HEIGHT - 2*TILE_SIZE)
+class Level:
+    """A parsed level: tiles, rings, terrain, collision grid and baked chunk surfaces."""
 
-    camera_x = 0
+    # Chunk surfaces are kept in surface_cache under ('chunk', serial) keys
+    _chunk_serials = itertools.count()
+    _live = weakref.WeakSet()
 
-    running = True
-    while running:
-        for event in pygame.event.get():
-            if event.type == pygame.QUIT:
-                pygame.quit()
-                sys.exit()
-            if event.type == pygame.KEYDOWN:
-                if event.key == pygame.K_ESCAPE:
-                    return MENU
+    def __init__(self, map_data):
+        self._parse(map_data)
 
-        player.update(tiles, rings)
+    def _parse(self, map_data):
+        self.map_data = list(map_data)
+        self.tiles, self.rings = load_level(self.map_data)
+        self.terrain = Terrain(self.map_data)
+        self.solid = self.terrain.grid != 0
+        self.width = len(self.map_data[0]) * TILE_SIZE
+        self.height = len(self.map_data) * TILE_SIZE
+        # The player starts just above the bottom row
+        self.start = (start_x(len(self.map_data[0])), self.height - 2*TILE_SIZE)
 
-        # Camera follow (smooth)
-        target_x = player.rect.centerx - SCREEN_WIDTH // 2
-        camera_x += (target_x - camera_x) * 0.1
-        max_camera_x = len(level_map[0]) * TILE_SIZE - SCREEN_WIDTH
-        camera_x = max(0, min(camera_x, max_camera_x))
+        # Map cell -> object, so a reload can find what an edit replaces
+        self.tile_at = {(tile.rect.x // TILE_SIZE, tile.rect.y // TILE_SIZE): tile
+                        for tile in self.tiles}
+        self.ring_at = {(ring.rect.x // TILE_SIZE, ring.rect.y // TILE_SIZE): ring
+                        for ring in self.rings}
 
-        # Draw everything
-        draw_sky(screen)
+        # Tiles bucketed by the chunk they are baked into
+        self.chunk_tiles = [[] for _ in range(-(-self.width // CHUNK_WIDTH))]
+        for tile in self.tiles:
+            self.chunk_tiles[tile.rect.x // CHUNK_WIDTH].append(tile)
+        # An edited chunk gets a new key, so a stale surface is never served
+        self.chunk_keys = [self._new_chunk_key() for _ in self.chunk_tiles]
+        self.baked = False
+        # Chunks whose tile list and surface belong to another Level too
+        self.shared_chunks = set()
+        self._track_chunks()
 
-        for tile in tiles:
-            tile.draw(screen, camera_x)
+    def _track_chunks(self):
+        # Once the level is dropped, chunk surfaces no live Level uses are
+        # dead weight in surface_cache, so they are discarded, not aged out
+        finalizer = getattr(self, '_finalizer', None)
+        if finalizer:
+            finalizer.detach()
+        Level._live.add(self)
+        self._finalizer = weakref.finalize(self, Level._discard_chunks, self.chunk_keys)
+        self._finalizer.atexit = False
 
-        for ring in rings:
-            ring.draw(screen, camera_x)
+    @staticmethod
+    def _discard_chunks(chunk_keys):
+        in_use = set()
+        for level in Level._live:
+            in_use.update(level.chunk_keys)
+        for key in chunk_keys:
+            if key not in in_use:
+                surface_cache.discard(key)
 
-        player.draw(screen, camera_x)
+    @staticmethod
+    def _new_chunk_key():
+        return ('chunk', next(Level._chunk_serials))
 
-        pygame.display.flip()
-        clock.tick(FPS)
+    def derive(self, map_data):
+        """A Level for map_data (same size) that shares what it has in common with this one.
 
-    return MENU
+        Chunks are copy-on-write: the new Level re-bakes and gets its own tile
+        list for just the chunks holding changed cells; every other chunk
+        surface, tile list, tile and ring is the same object in both.
+        """
+        other = copy.copy(self)
+        other.terrain = self.terrain.copy()
+        other.solid = self.solid.copy()
+        other.tile_at = dict(self.tile_at)
+        other.ring_at = dict(self.ring_at)
+        other.chunk_tiles = list(self.chunk_tiles)
+        other.chunk_keys = list(self.chunk_keys)
+        other.shared_chunks = set(range(len(self.chunk_tiles)))
+        other._finalizer = None
+        other._track_chunks()
+        other.apply(map_data)
+        self.shared_chunks |= other.shared_chunks
+        return other
 
-# ----------------------------------------------------------------------
-def main():
-    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
-    pygame.display.set_caption("Sonic CD - Green Hill Zone (Pixel Asset Demo)")
-    clock = pygame.time.Clock()
+    def _own_chunk(self, index):
+        # Copy a shared chunk's tile list before the first write to it
+        if index in self.shared_chunks:
+            self.shared_chunks.discard(index)
+            self.chunk_tiles[index] = list(self.chunk_tiles[index])
+        return self.chunk_tiles[index]
 
-    state = MENU
+    def apply(self, map_data):
+        """Updates the level in place to match map_data.
 
-    while True:
-        if state == MENU:
-            state = main_menu(screen, clock)
-        elif state == PLAYING:
-            state = play_game(screen, clock)
+        Only the changed cells are touched: their tiles, rings and collision
+        cells are replaced and just the chunks containing them are re-baked.
+        A change of size falls back to a full rebuild.  Returns the rings
+        (added, removed) so a running game can patch its own ring list.
+        """
+        map_data = list(map_data)
+        old_rings = list(self.rings)
+        shared = set(self.shared_chunks)
+        if (len(map_data) != len(self.map_data)
+                or len(map_data[0]) != len(self.map_data[0])):
+            for index, key in enumerate(self.chunk_keys):
+                if index not in shared:
+                    surface_cache.discard(key)
+            self._parse(map_data)
+            self.bake()
+            return list(self.rings), old_rings
+
+        added, removed = [], []
+        dirty = set()
+        for row, (old_row, new_row) in enumerate(zip(self.map_data, map_data)):
+            if old_row == new_row:
+                continue
+            for col, (old, new) in enumerate(zip(old_row, new_row)):
+                if old == new:
+                    continue
+                cell = (col, row)
+                if old in TILE_SHAPE_IDS:
+                    tile = self.tile_at.pop(cell)
+                    self._own_chunk(tile.rect.x // CHUNK_WIDTH).remove(tile)
+                    dirty.add(col * TILE_SIZE // CHUNK_WIDTH)
+                elif old == 'R':
+                    removed.append(self.ring_at.pop(cell))
+                if new in TILE_SHAPE_IDS:
+                    tile = Tile(col * TILE_SIZE, row * TILE_SIZE, TILE_SHAPE_IDS[new])
+                    self.tile_at[cell] = tile
+                    self._own_chunk(tile.rect.x // CHUNK_WIDTH).append(tile)
+                    dirty.add(col * TILE_SIZE // CHUNK_WIDTH)
+                elif new == 'R':
+                    ring = Ring(col * TILE_SIZE, row * TILE_SIZE + TILE_SIZE//2)
+                    self.ring_at[cell] = ring
+                    added.append(ring)
+                self.terrain.set(col, row, new)
+                self.solid[row, col] = new in TILE_SHAPE_IDS
+
+        self.map_data = map_data
+        if dirty:
+            self.tiles = list(self.tile_at.values())
+        if added or removed:
+            self.rings = list(self.ring_at.values())
+        for index in dirty:
+            if index not in shared:
+                surface_cache.discard(self.chunk_keys[index])
+            self.chunk_keys[index] = self._new_chunk_key()
+            if self.baked:
+                self.chunk(index)
+        return added, removed
+
+    def bake(self, progress=None):
+        """Pre-renders every chunk; progress(fraction) is called after each one."""
+        for fraction in self.bake_steps():
+            if progress:
+                progress(fraction)
+
+    def bake_steps(self):
+        """Pre-renders the chunks one at a time, yielding the fraction done after each."""
+        for index in range(len(self.chunk_tiles)):
+            self.chunk(index)
+            yield (index + 1) / len(self.chunk_tiles)
+        self.baked = True
+
+    def chunk(self, index):
+        """The surface of chunk index, baked now if it is not in surface_cache."""
+        return surface_cache.get(self.chunk_keys[index],
+                                 functools.partial(self._bake_chunk, index))
+
+    def _bake_chunk(self, index):
+        # Chunks start TUFT_HEIGHT above the map so top-row tufts fit
+        x0 = index * CHUNK_WIDTH
+        surf = pygame.Surface((CHUNK_WIDTH, self.height + TUFT_HEIGHT))
+        surf.fill(CHUNK_COLORKEY)
+        surf.set_colorkey(CHUNK_COLORKEY, pygame.RLEACCEL)
+        # Row by row, as a fresh load lists them, so each row's tufts are
+        # drawn over the tiles above and a re-baked chunk matches a reload
+        tiles = sorted(self.chunk_tiles[index], key=lambda tile: (tile.rect.y, tile.rect.x))
+        surf.blits([(Tile.get_image(tile.shape), (tile.rect.x - x0, tile.rect.y))
+                    for tile in tiles], doreturn=False)
+        return surf
+
+    def blit_items(self, camera_x, view_width=SCREEN_WIDTH):
+        """(chunk, position) pairs for the chunks overlapping the view."""
+        cam = int(camera_x)
+        first = max(0, cam // CHUNK_WIDTH)
+        last = min(len(self.chunk_keys), (cam + view_width) // CHUNK_WIDTH + 1)
+        return [(self.chunk(i), (i * CHUNK_WIDTH - cam, -TUFT_HEIGHT))
+                for i in range(first, last)]
+
+
+class LoadedLevel:
+    """Everything play_game needs to start a run, ready to use."""
+
+    def __init__(self, level, player, background, particles, periods=None):
+        self.level = level
+        self.player = player
+        self.background = background
+        self.particles = particles
+        # The level in each time period, by ZONE_PERIODS name
+        self.periods = periods or {'present': level}
+
+
+class LevelLoader:
+    """Parses and bakes a level and its assets on a worker thread.
+
+    With a FrameScheduler the load is streamed instead: a task on the
+    game's event loop runs one step (one chunk bake, say) per idle slice
+    of the frame budget.
+
+    progress is a fraction in [0, 1] that can be read at any time. The
+    finished LoadedLevel is published in one step under a lock, and take()
+    hands it over exactly once.
+    """
+
+    def __init__(self, map_data=level_map, scheduler=None, periods=None):
+        self.map_data = map_data
+        self.scheduler = scheduler
+        self.periods = periods or {}  # Other time periods' maps, by name
+        self.progress = 0.0
+        self._lock = threading.Lock()
+        self._worker = None
+        self._result = None
+
+    def start(self):
+        """Begins loading the level unless a load is already pending."""
+        if self._worker is not None:
+            return
+        self.progress = 0.0
+        if self.scheduler:
+            self._worker = asyncio.get_running_loop().create_task(self._stream(self.map_data))
+        else:
+            self._worker = threading.Thread(target=self._run, args=(self.map_data,),
+                                            name="level-loader", daemon=True)
+            self._worker.start()
+
+    def _steps(self, map_data):
+        # Yields between steps; the LoadedLevel is the generator's return value
+        level = Level(map_data)
+        self.progress = 0.1
+        yield
+        for fraction in level.bake_steps():
+            self.progress = 0.1 + 0.6 * fraction
+            yield
+        periods = {'present': level}
+        for name, period_map in self.periods.items():
+            periods[name] = level.derive(period_map)
+            yield
+        player = Player(*level.start)
+        self.progress = 0.8
+        yield
+        background = ParallaxBackground()
+        self.progress = 0.95
+        return LoadedLevel(level, player, background, ParticlePool(), periods)
+
+    def _run(self, map_data):
+        steps = self._steps(map_data)
+        try:
+            while True:
+                next(steps)
+        except StopIteration as done:
+            result = done.value
+        except Exception as exc:
+            result = exc  # Re-raised on the game thread by take()
+        self._publish(result)
+
+    async def _stream(self, map_data):
+        steps = self._steps(map_data)
+        try:
+            while True:
+                await self.scheduler.idle()
+                next(steps)
+        except StopIteration as done:
+            result = done.value
+        except Exception as exc:
+            result = exc
+        self._publish(result)
+
+    def _publish(self, result):
+        with self._lock:
+            self._result = result
+            self.progress = 1.0
+
+    @property
+    def ready(self):
+        return self._result is not None
+
+    def take(self):
+        """Returns the finished load (once), or None if it is still in progress."""
+        with self._lock:
+            result, self._result = self._result, None
+        if result is None:
+            return None
+        self._worker = None
+        if isinstance(result, Exception):
+            raise result
+        return result
+
+
+async def loading_screen(screen, clock, loader, renderer=None):
+    """Shows a progress bar until the loader finishes, then returns its result."""
+    bar = pygame.Rect(0, 0, SCREEN_WIDTH // 2, 12)
+    bar.center = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
+    while True:
+        loaded = loader.take()
+        if loaded is not None:
+            return loaded
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+        screen.fill(MENU_BG)
+        pygame.draw.rect(screen, TEXT_COLOR, bar, 1)
+        filled = bar.inflate(-4, -4)
+        filled.width = int(filled.width * loader.progress)
+        pygame.draw.rect(screen, SELECTED_COLOR, filled)
+        if renderer:
+            renderer.flip(screen)
+        else:
+            pygame.display.flip()
+        await clock.tick(FPS)
+
+# ----------------------------------------------------------------------
+# Level files hold one map row per line, in the same characters as level_map
+def load_map_file(path):
+    with open(path) as f:
+        rows = [line.strip() for line in f if line.strip()]
+    if not rows:
+        raise ValueError(f"{path}: no map rows")
+    if any(len(row) != len(rows[0]) for row in rows):
+        raise ValueError(f"{path}: rows must all be {len(rows[0])} cells wide")
+    if set("".join(rows)) - set('0R' + TILE_SHAPES):
+        raise ValueError(f"{path}: map cells must be 0, R or one of {TILE_SHAPES}")
+    return rows
+
+
+class LevelWatcher:
+    """Polls a level file and hands back its new rows whenever it is saved.
+
+    Checked at most every interval seconds from the game loop; a file that
+    fails to parse is reported and skipped so the running level survives
+    a half-finished edit.
+    """
+
+    def __init__(self, path, interval=0.25):
+        self.path = path
+        self.interval = interval
+        self._mtime = os.stat(path).st_mtime_ns
+        self._next_check = time.perf_counter() + interval
+
+    def poll(self):
+        now = time.perf_counter()
+        if now < self._next_check:
+            return None
+        self._next_check = now + self.interval
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+            if mtime == self._mtime:
+                return None
+            self._mtime = mtime
+            return load_map_file(self.path)
+        except (OSError, ValueError) as e:
+            print(f"level reload skipped: {e}")
+            return None
+
+# ----------------------------------------------------------------------
+class GameSnapshot:
+    """Packs a run's simulation state into a fixed-size buffer and back.
+
+    A snapshot is the frame number, one PLAYER record per player (fixed-point
+    motion, counters, animation and its camera) and a bitset of which of the
+    level's rings are still uncollected. Buffers come from new_buffer() and
+    are reused, so saving allocates nothing but the ring bitset. Snapshots
+    belong to one Level; a hot reload that adds or removes rings voids them.
+    """
+
+    FRAME = struct.Struct('<I')
+    # xpos, ypos, xsp, ysp, spin_charge, ring_count,
+    # on_ground | facing_right << 1, angle, state, frame_index, anim_timer,
+    # animation_speed, camera_x
+    PLAYER = struct.Struct('<iiiiHHBBBBBBf')
+    STATES = ('idle', 'run', 'jump')
+
+    def __init__(self, level, players=1):
+        self.level = level
+        self.players = players
+        self.rings = list(level.rings)
+        self.ring_index = {ring: 1 << i for i, ring in enumerate(self.rings)}
+        self.ring_bytes = (len(level.rings) + 7) // 8
+        self.rings_offset = self.FRAME.size + players * self.PLAYER.size
+        self.size = self.rings_offset + self.ring_bytes
+        self.state_index = {state: i for i, state in enumerate(self.STATES)}
+
+    def new_buffer(self):
+        return bytearray(self.size)
+
+    def save(self, buffer, frame, players, cameras, rings):
+        """Writes the state of players (with their cameras) and rings into buffer."""
+        self.FRAME.pack_into(buffer, 0, frame)
+        offset = self.FRAME.size
+        for player, camera_x in zip(players, cameras):
+            self.PLAYER.pack_into(
+                buffer, offset, player.xpos, player.ypos, player.xsp, player.ysp,
+                player.spin_charge, player.ring_count,
+                player.on_ground | player.facing_right << 1, player.angle,
+                self.state_index[player.state], player.frame_index, player.anim_timer,
+                player.animation_speed, camera_x)
+            offset += self.PLAYER.size
+        bits = sum(map(self.ring_index.__getitem__, rings))
+        buffer[self.rings_offset:self.size] = bits.to_bytes(self.ring_bytes, 'little')
+        return buffer
+
+    def restore(self, buffer, players, rings):
+        """Rewinds players and rings (in place) to buffer; returns (frame, cameras).
+
+        The whole buffer is checked first, so one that is not a snapshot of
+        this level raises ValueError and leaves players and rings untouched.
+        """
+        if len(buffer) != self.size:
+            raise ValueError(f"snapshot is {len(buffer)} bytes, expected {self.size}")
+        frame, = self.FRAME.unpack_from(buffer, 0)
+        records = [self.PLAYER.unpack_from(buffer, self.FRAME.size + i * self.PLAYER.size)
+                   for i in range(len(players))]
+        for record in records:
+            if record[8] >= len(self.STATES):
+                raise ValueError(f"snapshot has unknown animation state {record[8]}")
+        bits = np.unpackbits(np.frombuffer(buffer, np.uint8, self.ring_bytes, self.rings_offset),
+                             bitorder='little')
+        if bits[len(self.rings):].any():
+            raise ValueError("snapshot marks rings this level does not have")
+
+        cameras = []
+        for player, record in zip(players, records):
+            (player.xpos, player.ypos, player.xsp, player.ysp, player.spin_charge,
+             player.ring_count, flags, player.angle, state, player.frame_index,
+             player.anim_timer, player.animation_speed, camera_x) = record
+            player.on_ground = bool(flags & 1)
+            player.facing_right = bool(flags & 2)
+            player.state = self.STATES[state]
+            player.rect.topleft = (player.xpos >> SUBPIXEL_SHIFT, player.ypos >> SUBPIXEL_SHIFT)
+            player.events.clear()
+            cameras.append(camera_x)
+        rings[:] = itertools.compress(self.rings, bits[:len(self.rings)].tolist())
+        return frame, cameras
+
+# ----------------------------------------------------------------------
+class FrameCapture:
+    """Records presented frames to disk without stalling the game loop.
+
+    capture() copies the display surface's pixels through its buffer view
+    into a free slot of a preallocated ring buffer and returns; a worker
+    thread converts and writes the filled slots. If the writer falls behind
+    and no slot is free the frame is dropped rather than waiting.
+
+    Formats: 'y4m' (YUV 4:2:0, plays in ffmpeg/mpv), 'raw' (packed RGB24,
+    e.g. ffmpeg -f rawvideo -pix_fmt rgb24 -s 600x400) and 'png' (a numbered
+    sequence in the directory at path).
+    """
+
+    FORMATS = ('y4m', 'raw', 'png')
+
+    def __init__(self, path, surface, fmt='y4m', slots=CAPTURE_SLOTS):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"unknown capture format {fmt!r}")
+        if surface.get_bytesize() != 4 or surface.get_pitch() != surface.get_width() * 4:
+            raise ValueError("frame capture needs a packed 32-bit display surface")
+        self.path = path
+        self.fmt = fmt
+        self.size = surface.get_size()
+        self.shifts = surface.get_shifts()[:3]
+
+        frame_bytes = surface.get_view('0').length
+        self.slots = [bytearray(frame_bytes) for _ in range(slots)]
+        self.free = queue.SimpleQueue()
+        for index in range(slots):
+            self.free.put(index)
+        self.filled = queue.SimpleQueue()
+
+        self.frames = 0
+        self.written = 0
+        self.dropped = 0
+        self.copy_time = 0.0
+
+        if fmt == 'png':
+            os.makedirs(path, exist_ok=True)
+            self.out = None
+        else:
+            self.out = open(path, 'wb')
+            if fmt == 'y4m':
+                width, height = self.size
+                self.out.write(f"YUV4MPEG2 W{width} H{height} F{FPS}:1 Ip A1:1 C420jpeg XCOLORRANGE=FULL\n".encode())
+        self.worker = threading.Thread(target=self._run, name="frame-capture", daemon=True)
+        self.worker.start()
+
+    def capture(self, surface):
+        """Queues the current contents of surface; never blocks."""
+        start = time.perf_counter()
+        self.frames += 1
+        try:
+            index = self.free.get_nowait()
+        except queue.Empty:
+            self.dropped += 1
+        else:
+            memoryview(self.slots[index])[:] = surface.get_view('0')
+            self.filled.put(index)
+        self.copy_time += time.perf_counter() - start
+
+    def close(self):
+        """Flushes pending frames, stops the worker and prints a summary."""
+        self.filled.put(None)
+        self.worker.join()
+        if self.out:
+            self.out.close()
+        overhead = self.copy_time * 1000 / max(self.frames, 1)
+        print(f"capture: {self.written} frames written to {self.path}, "
+              f"{self.dropped} dropped, {overhead:.3f} ms/frame on the game loop")
+
+    def _run(self):
+        while True:
+            index = self.filled.get()
+            if index is None:
+                return
+            rgb = self._to_rgb(self.slots[index])
+            self.free.put(index)
+            self._write(rgb)
+            self.written += 1
+
+    def _to_rgb(self, data):
+        width, height = self.size
+        pixels = np.frombuffer(data, dtype=np.uint32).reshape(height, width)
+        return np.dstack([(pixels >> shift).astype(np.uint8) for shift in self.shifts])
+
+    def _write(self, rgb):
+        if self.fmt == 'raw':
+            self.out.write(rgb.tobytes())
+        elif self.fmt == 'png':
+            image = pygame.image.frombuffer(rgb.tobytes(), self.size, 'RGB')
+            pygame.image.save(image, os.path.join(self.path, f"frame_{self.written:06d}.png"))
+        else:
+            self.out.write(b"FRAME\n")
+            self.out.write(_rgb_to_yuv420(rgb))
+
+
+def _rgb_to_yuv420(rgb):
+    """Planar full-range BT.601 YUV with 2x2-averaged chroma, as Y4M expects."""
+    rgb = rgb.astype(np.float32)
+    r, g, b = rgb[..., 0], rgb[..., 1], rgb[..., 2]
+    y = 0.299 * r + 0.587 * g + 0.114 * b
+    u = (b - y) * 0.564 + 128
+    v = (r - y) * 0.713 + 128
+    height, width = y.shape
+    u = u[:height & ~1, :width & ~1].reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3))
+    v = v[:height & ~1, :width & ~1].reshape(height // 2, 2, width // 2, 2).mean(axis=(1, 3))
+    return b"".join(np.clip(plane, 0, 255).astype(np.uint8).tobytes() for plane in (y, u, v))
+
+# ----------------------------------------------------------------------
+class Telemetry:
+    """Per-frame performance and gameplay records for headless runs.
+
+    record() keeps every sample_rate-th frame in an in-memory batch; full
+    batches are encoded and appended to path (if given) by a background
+    thread, so the game loop never touches the file, and can also be
+    streamed to a local sink by upload(). Garbage collections are tracked
+    via gc.callbacks and attributed to the next record.
+
+    'jsonl' writes one JSON object per line. 'binary' writes back-to-back
+    little-endian RECORD structs with fields in FIELDS order.
+    """
+
+    FORMATS = ('jsonl', 'binary')
+    FIELDS = ('frame', 'frame_ms', 'update_ms', 'draw_ms', 'rings',
+              'x', 'y', 'vx', 'vy', 'gc_collections', 'gc_ms')
+    RECORD = struct.Struct('<I3fH4fHf')
+
+    def __init__(self, path, sample_rate=1, fmt='jsonl'):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"unknown telemetry format {fmt!r}")
+        self.sample_rate = max(1, sample_rate)
+        self.fmt = fmt
+        self.batch = []
+        self.uploads = None
+        self.closed = False
+        self.writer = None
+        if path:
+            self.out = open(path, 'wb')
+            self.pending = queue.SimpleQueue()
+            self.writer = threading.Thread(target=self._run, name="telemetry", daemon=True)
+            self.writer.start()
+
+        self.gc_collections = 0
+        self.gc_time = 0.0
+        self._gc_start = 0.0
+        gc.callbacks.append(self._on_gc)
+
+    def _on_gc(self, phase, info):
+        if phase == 'start':
+            self._gc_start = time.perf_counter()
+        else:
+            self.gc_collections += 1
+            self.gc_time += time.perf_counter() - self._gc_start
+
+    def record(self, frame, frame_ms, update_ms, draw_ms, player):
+        if frame % self.sample_rate:
+            return
+        self.batch.append((frame, frame_ms, update_ms, draw_ms, player.ring_count,
+                           player.rect.x, player.rect.y, player.vx, player.vy,
+                           self.gc_collections, self.gc_time * 1000))
+        self.gc_collections = 0
+        self.gc_time = 0.0
+        if len(self.batch) >= TELEMETRY_BATCH:
+            self._flush_batch()
+
+    def _flush_batch(self):
+        if self.writer:
+            self.pending.put(self.batch)
+        if self.uploads is not None:
+            self.uploads.put_nowait(self.batch)
+        self.batch = []
+
+    def close(self):
+        gc.callbacks.remove(self._on_gc)
+        self.closed = True
+        self._flush_batch()
+        if self.uploads is not None:
+            self.uploads.put_nowait(None)
+        if self.writer:
+            self.pending.put(None)
+            self.writer.join()
+            self.out.close()
+
+    def _encode(self, batch):
+        if self.fmt == 'jsonl':
+            return "".join(json.dumps(dict(zip(self.FIELDS, row))) + "\n"
+                           for row in batch).encode()
+        return b"".join(self.RECORD.pack(*row) for row in batch)
+
+    def _run(self):
+        while True:
+            batch = self.pending.get()
+            if batch is None:
+                return
+            self.out.write(self._encode(batch))
+            self.out.flush()
+
+    async def upload(self, address, scheduler):
+        """Streams batches to a sink on HOST:PORT or a Unix socket in frame idle time.
+
+        Runs until close(); call it from a task on the scheduler's loop.
+        """
+        try:
+            if ':' in address:
+                host, port = address.rsplit(':', 1)
+                _, writer = await asyncio.open_connection(host, int(port))
+            else:
+                _, writer = await asyncio.open_unix_connection(address)
+        except OSError as exc:
+            print(f"telemetry sink {address} unavailable: {exc}")
+            return
+        if self.closed:
+            # close() ran while connecting, so no end marker will come
+            writer.close()
+            return
+        self.uploads = asyncio.Queue()
+        try:
+            while True:
+                batch = await self.uploads.get()
+                if batch is None:
+                    break
+                await scheduler.idle()
+                writer.write(self._encode(batch))
+                await writer.drain()
+        finally:
+            self.uploads = None
+            writer.close()
+
+# ----------------------------------------------------------------------
+class SamplingProfiler:
+    """Statistical profiler for soak runs that needs no hooks in the code it measures.
+
+    A background thread wakes rate times a second, takes the target
+    thread's current frame from sys._current_frames() and counts its stack
+    as a tuple of code objects; nothing is formatted until close(), which
+    writes one "outer;...;inner count" line per distinct stack: the
+    collapsed format flamegraph.pl, inferno and speedscope read.
+
+    The sampler can only look once the game thread hands over the GIL,
+    which CPython forces every switch interval (5 ms by default).  Left at
+    that, samples bunch up wherever the game releases the GIL itself
+    (sleeps, I/O) instead of where its time goes, so the interval is
+    shortened to PROFILE_SWITCH_INTERVAL while sampling.
+    """
+
+    def __init__(self, path, rate=PROFILE_RATE, thread_id=None):
+        self.path = path
+        self.interval = 1 / rate
+        self.target = thread_id or threading.get_ident()
+        self.samples = {}
+        self.cpu_time = 0.0  # Seconds the sampler thread itself spent on the CPU
+        self.switch_interval = sys.getswitchinterval()
+        sys.setswitchinterval(min(self.switch_interval, PROFILE_SWITCH_INTERVAL))
+        self.stopping = threading.Event()
+        self.sampler = threading.Thread(target=self._run, name="profiler", daemon=True)
+        self.sampler.start()
+
+    def _run(self):
+        samples = self.samples
+        target = self.target
+        start = time.thread_time()
+        while not self.stopping.wait(self.interval):
+            frame = sys._current_frames().get(target)
+            stack = []
+            while frame is not None:
+                stack.append(frame.f_code)
+                frame = frame.f_back
+            stack = tuple(stack)
+            samples[stack] = samples.get(stack, 0) + 1
+        self.cpu_time = time.thread_time() - start
+
+    @staticmethod
+    def _label(code):
+        name = getattr(code, 'co_qualname', code.co_name)
+        return f"{name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+    def close(self):
+        """Stops sampling and writes the collapsed stacks; returns the sample count."""
+        self.stopping.set()
+        self.sampler.join()
+        sys.setswitchinterval(self.switch_interval)
+        label = self._label
+        lines = {}
+        for stack, count in self.samples.items():
+            line = ";".join(label(code) for code in reversed(stack))
+            lines[line] = lines.get(line, 0) + count
+        if self.path:
+            with open(self.path, 'w') as out:
+                out.writelines(f"{line} {count}\n" for line, count in sorted(lines.items()))
+        return sum(lines.values())
+
+# ----------------------------------------------------------------------
+# Fonts are created on first use and cached; rendered text lives in surface_cache
+_fonts = {}
+
+def get_font(size):
+    """Returns the default font at size, starting pygame.font if needed."""
+    font = _fonts.get(size)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = _fonts[size] = pygame.font.Font(None, size)
+    return font
+
+def render_text(text, color, size=36):
+    """Returns a cached antialiased rendering of text."""
+    return surface_cache.get(('text', text, color, size),
+                             lambda: get_font(size).render(text, True, color))
+
+# ----------------------------------------------------------------------
+class FrameScheduler:
+    """Paces frames on an asyncio loop and lends each frame's slack to other tasks.
+
+    Awaiting tick() stands in for Clock.tick(): it sleeps on the event loop
+    until SPIN seconds before the frame deadline, so background coroutines
+    run in the idle part of the frame, then busy-waits the rest for precise
+    pacing. Background work awaits idle() before each step; it resumes only
+    while the frame task is parked with at least `need` seconds to spare.
+    ticks() stands in for pygame.time.get_ticks(), which stays at 0 since
+    SDL's timer is never started.
+    """
+
+    SPIN = 0.002
+
+    def __init__(self):
+        self.deadline = time.perf_counter()
+        self.last_tick = self.deadline
+        self.started = self.deadline
+        self.idle_until = 0.0
+        self._idle = asyncio.Event()
+
+    async def tick(self, fps=FPS):
+        """Waits out the rest of the frame; returns milliseconds since the last tick."""
+        now = time.perf_counter()
+        # A late frame restarts the cadence instead of rushing to catch up
+        self.deadline = max(self.deadline + 1.0 / fps, now)
+        self.idle_until = self.deadline - self.SPIN
+        self._idle.set()
+        if self.idle_until > now:
+            await asyncio.sleep(self.idle_until - now)
+        else:
+            await asyncio.sleep(0)
+        self._idle.clear()
+        while time.perf_counter() < self.deadline:
+            pass
+        now = time.perf_counter()
+        elapsed, self.last_tick = now - self.last_tick, now
+        return elapsed * 1000
+
+    def ticks(self):
+        """Milliseconds since the scheduler was created, for animation."""
+        return int((time.perf_counter() - self.started) * 1000)
+
+    async def idle(self, need=0.001):
+        """Returns once the frame task is idle with at least need seconds left."""
+        while True:
+            await self._idle.wait()
+            spare = self.idle_until - time.perf_counter()
+            if spare >= need:
+                return
+            await asyncio.sleep(max(0.0, spare))
+
+    def stop(self):
+        """Leaves the loop permanently idle so background tasks can drain."""
+        self.idle_until = math.inf
+        self._idle.set()
+
+# ----------------------------------------------------------------------
+async def main_menu(screen, clock, loader, exit_after_first_frame=False, renderer=None):
+    options = ["Start Game", "2 Player Split-Screen", "Quit"]
+    selected = 0
+
+    # Prefetch the level while the player is still choosing
+    loader.start()
+
+    while True:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_UP:
+                    selected = (selected - 1) % len(options)
+                elif event.key == pygame.K_DOWN:
+                    selected = (selected + 1) % len(options)
+                elif event.key == pygame.K_RETURN:
+                    if selected == 0:
+                        return PLAYING
+                    elif selected == 1:
+                        return PLAYING_SPLIT
+                    elif selected == 2:
+                        pygame.quit()
+                        sys.exit()
+
+        screen.fill(MENU_BG)
+
+        title = render_text("Sonic CD - Green Hill Zone", TEXT_COLOR)
+        title_rect = title.get_rect(center=(SCREEN_WIDTH//2, 100))
+        screen.blit(title, title_rect)
+
+        for i, opt in enumerate(options):
+            color = SELECTED_COLOR if i == selected else TEXT_COLOR
+            text = render_text(opt, color)
+            text_rect = text.get_rect(center=(SCREEN_WIDTH//2, 200 + i*50))
+            screen.blit(text, text_rect)
+
+        if renderer:
+            renderer.flip(screen)
+        else:
+            pygame.display.flip()
+        if exit_after_first_frame:
+            print("first-frame", flush=True)
+            pygame.quit()
+            sys.exit()
+        await clock.tick(FPS)
+
+# ----------------------------------------------------------------------
+def follow_camera(camera_x, player, level, view_width=SCREEN_WIDTH):
+    """Eases the camera towards the player, clamped to the level."""
+    target_x = player.rect.centerx - view_width // 2
+    camera_x += (target_x - camera_x) * 0.1
+    max_camera_x = level.width - view_width
+    return max(0, min(camera_x, max_camera_x))
+
+
+class Viewport:
+    """One racer's camera onto a column of the display.
+
+    Drawing goes into a subsurface (or, with a TextureRenderer, a renderer
+    viewport), so blits are clipped to the column for free and every
+    viewport reuses the level chunks, backdrop strips and sprite caches; per
+    viewport only culling and blitting are repeated.
+    """
+
+    def __init__(self, screen, rect, player, renderer=None):
+        self.rect = pygame.Rect(rect)
+        self.surface = screen.subsurface(self.rect)
+        self.renderer = renderer
+        self.player = player
+        self.camera_x = 0
+        self.draw_list = DrawList()
+
+    def follow(self, level):
+        self.camera_x = follow_camera(self.camera_x, self.player, level, self.rect.width)
+
+    def draw(self, level, background, rings, players, particles, ticks):
+        """Draws the world, this viewport's racer and every other racer in view."""
+        cam = int(self.camera_x)
+        width = self.rect.width
+        draw_list = self.draw_list
+        draw_list.extend(LAYER_BACKGROUND, background.blit_items(cam, ticks, width))
+        queue_world(draw_list, level, rings, self.player, particles, cam, ticks, width)
+        sheet = Player.sprite_sheet()
+        for other in players:
+            if other is not self.player and cam - TILE_SIZE < other.rect.x < cam + width:
+                draw_list.add(LAYER_PLAYER, sheet, other.draw_pos(cam), other.current_area())
+        if self.renderer:
+            self.renderer.submit(draw_list, self.rect)
+        else:
+            draw_list.submit(self.surface)
+
+
+def split_viewports(screen, players, renderer=None):
+    """Side-by-side viewports, one full-height column per player."""
+    width = screen.get_width() // len(players)
+    return [Viewport(screen, (i * width, 0, width, screen.get_height()), player, renderer)
+            for i, player in enumerate(players)]
+
+
+class RemappedKeys:
+    """Live keyboard state seen through another set of bindings.
+
+    bindings maps each key Player.update reads to the key this player
+    actually presses; every other key reads as released.
+    """
+
+    def __init__(self, bindings):
+        self.bindings = bindings
+        self.pressed = None
+
+    def __getitem__(self, key):
+        return key in self.bindings and self.pressed[self.bindings[key]]
+
+
+# Player two races on WASD
+SECOND_PLAYER_KEYS = {
+    pygame.K_LEFT: pygame.K_a,
+    pygame.K_RIGHT: pygame.K_d,
+    pygame.K_SPACE: pygame.K_w,
+    pygame.K_DOWN: pygame.K_s,
+}
+
+async def play_game(screen, clock, loader, capture=None, telemetry=None, max_frames=None,
+                    watcher=None, split=False, renderer=None):
+    loaded = loader.take() or await loading_screen(screen, clock, loader, renderer)
+    level = loaded.level
+    terrain = level.terrain
+    rings = list(level.rings)
+    player = loaded.player
+    particles = loaded.particles
+    background = loaded.background
+
+    # In split-screen a second racer starts alongside on WASD; both race
+    # for the same rings
+    racers = [player]
+    controls = [None]
+    if split:
+        x, y = level.start
+        racers.append(Player(x + RACER_SPACING, y))
+        controls.append(RemappedKeys(SECOND_PLAYER_KEYS))
+    viewports = split_viewports(screen, racers, renderer)
+    # F5 saves the run, F9 rewinds to the save
+    snapshot = GameSnapshot(level, len(racers))
+    saved = None
+    # T warps between time periods; each keeps its own uncollected rings
+    period = 'present'
+    period_rings = {}
+
+    audio = get_audio()
+    frame = 0
+    frame_start = time.perf_counter()
+
+    running = True
+    while running:
+        for event in pygame.event.get():
+            if event.type == pygame.QUIT:
+                pygame.quit()
+                sys.exit()
+            if event.type == pygame.KEYDOWN:
+                if event.key == pygame.K_ESCAPE:
+                    return MENU
+                if event.key == pygame.K_F5:
+                    saved = snapshot.save(saved or snapshot.new_buffer(), frame, racers,
+                                          [view.camera_x for view in viewports], rings)
+                elif event.key == pygame.K_F9 and saved:
+                    _, cameras = snapshot.restore(saved, racers, rings)
+                    for view, camera_x in zip(viewports, cameras):
+                        view.camera_x = camera_x
+                elif event.key == pygame.K_p:
+                    # Cycle the sprite palettes
+                    names = list(SPRITE_PALETTES)
+                    Player.set_palette(names[(names.index(Player.palette) + 1) % len(names)])
+                elif event.key == pygame.K_t and len(loaded.periods) > 1:
+                    # Every period is already resident, so a warp is a swap
+                    period_rings[period] = rings
+                    names = [name for name in ZONE_PERIODS if name in loaded.periods]
+                    period = names[(names.index(period) + 1) % len(names)]
+                    level = loaded.periods[period]
+                    terrain = level.terrain
+                    rings = period_rings.setdefault(period, list(level.rings))
+                    snapshot = GameSnapshot(level, len(racers))
+                    saved = None
+                    Player.set_palette(period if period in SPRITE_PALETTES else 'normal')
+
+        if watcher:
+            map_data = watcher.poll()
+            if map_data is not None:
+                reload_start = time.perf_counter()
+                added, removed = level.apply(map_data)
+                # A restart rebuilds the edited map, not the one loaded first
+                loader.map_data = level.map_data
+                rings = [ring for ring in rings if ring not in removed] + added
+                terrain = level.terrain
+                if added or removed:
+                    snapshot = GameSnapshot(level, len(racers))
+                    saved = None
+                print(f"level reloaded: +{len(added)}/-{len(removed)} rings in "
+                      f"{(time.perf_counter() - reload_start) * 1000:.2f} ms")
+
+        update_start = time.perf_counter()
+        for racer, keys in zip(racers, controls):
+            if keys is not None:
+                keys.pressed = pygame.key.get_pressed()
+            racer.update(terrain, rings, keys)
+            feet = (racer.rect.centerx, racer.rect.bottom - 2)
+            for event in racer.events:
+                if event in EVENT_SOUNDS:
+                    audio.play(EVENT_SOUNDS[event])
+                if event in ('jump', 'land'):
+                    particles.dust(*feet)
+                elif event == 'spin_charge':
+                    particles.spin_dash(feet[0], feet[1], racer.facing_right)
+        particles.update(level.terrain)
+
+        for view in viewports:
+            view.follow(level)
+
+        # Draw everything
+        draw_start = time.perf_counter()
+        ticks = clock.ticks()
+        for view in viewports:
+            view.draw(level, background, rings, racers, particles, ticks)
+        if renderer:
+            for view in viewports[1:]:
+                renderer.fill(VIEWPORT_DIVIDER, (view.rect.x, 0, 2, view.rect.height))
+            if capture:
+                renderer.read(screen)
+                capture.capture(screen)
+            renderer.present()
+        else:
+            for view in viewports[1:]:
+                pygame.draw.line(screen, VIEWPORT_DIVIDER, view.rect.topleft,
+                                 view.rect.bottomleft, 2)
+            pygame.display.flip()
+            if capture:
+                capture.capture(screen)
+        draw_end = time.perf_counter()
+        await clock.tick(FPS)
+
+        frame += 1
+        now = time.perf_counter()
+        if telemetry:
+            telemetry.record(frame, (now - frame_start) * 1000, (draw_start - update_start) * 1000,
+                             (draw_end - draw_start) * 1000, player)
+        frame_start = now
+        if max_frames and frame >= max_frames:
+            running = False
+
+    return MENU
+
+# ----------------------------------------------------------------------
+# Local control server
+#
+# Requests and replies share one little-endian header, HEADER:
+#   opcode u8, flags u8, session u16, count u32
+# followed by a payload of `count` bytes, in requests as in replies.
+# Requests:
+#   OP_CREATE  start a session on the server's level; reply: one STATE
+#   OP_STEP    payload is `count` action bytes (ACTION_* bits), one per frame;
+#              reply: the STATE after the last frame, or one STATE per frame
+#              with FLAG_ALL_STATES
+#   OP_FRAME   reply: the session's view as packed RGB24, SCREEN_WIDTH x
+#              SCREEN_HEIGHT
+#   OP_RESET   restart the session; reply: one STATE
+#   OP_CLOSE   end the session; empty reply
+#   OP_SAVE    reply: a GameSnapshot of the session (opaque bytes)
+#   OP_LOAD    payload is `count` bytes of an OP_SAVE reply from any session;
+#              rewinds this session to it; reply: one STATE
+# Reply headers echo the opcode and session, carry STATUS_OK or STATUS_ERROR
+# in flags and the payload length in count (an error's payload is its
+# message). An unknown opcode, or a payload on a request that takes none,
+# is answered with an error and the payload skipped. Requests may be
+# pipelined: every complete request that has arrived is answered, and the
+# replies go back in order in a single send.
+
+OP_CREATE = 1
+OP_STEP = 2
+OP_FRAME = 3
+OP_RESET = 4
+OP_CLOSE = 5
+OP_SAVE = 6
+OP_LOAD = 7
+# Requests that take a payload
+PAYLOAD_OPS = (OP_STEP, OP_LOAD)
+KNOWN_OPS = (OP_CREATE, OP_STEP, OP_FRAME, OP_RESET, OP_CLOSE, OP_SAVE, OP_LOAD)
+
+FLAG_ALL_STATES = 1
+STATUS_OK = 0
+STATUS_ERROR = 1
+
+HEADER = struct.Struct('<BBHI')
+# frame, x, y, vx, vy, ring_count, rings_left, on_ground | facing_right << 1
+STATE = struct.Struct('<IiiffHHB')
+
+
+class ActionKeys:
+    """An action byte presented through the pygame.key.get_pressed() interface."""
+
+    KEYS = {
+        pygame.K_LEFT: ACTION_LEFT,
+        pygame.K_RIGHT: ACTION_RIGHT,
+        pygame.K_SPACE: ACTION_JUMP,
+        pygame.K_DOWN: ACTION_DOWN,
+    }
+
+    def __init__(self, actions=0):
+        self.actions = actions
+
+    def __getitem__(self, key):
+        return bool(self.actions & self.KEYS.get(key, 0))
+
+
+class ControlSession:
+    """One remotely driven run: a Player and its rings on a shared Level."""
+
+    def __init__(self, level):
+        self.level = level
+        self.keys = ActionKeys()
+        self.screen = None
+        self.snapshot = GameSnapshot(level)
+        # Held by the server while a request runs on this session
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        self.player = Player(*self.level.start)
+        self.rings = list(self.level.rings)
+        self.camera_x = 0
+        self.frame = 0
+
+    def step(self, actions):
+        self.keys.actions = actions
+        self.player.update(self.level.terrain, self.rings, self.keys)
+        self.camera_x = follow_camera(self.camera_x, self.player, self.level)
+        self.frame += 1
+
+    def save(self):
+        return bytes(self.snapshot.save(self.snapshot.new_buffer(), self.frame,
+                                        (self.player,), (self.camera_x,), self.rings))
+
+    def load(self, data):
+        self.frame, (self.camera_x,) = self.snapshot.restore(data, (self.player,), self.rings)
+
+    def state(self):
+        player = self.player
+        flags = player.on_ground | player.facing_right << 1
+        return STATE.pack(self.frame, player.rect.x, player.rect.y, player.vx, player.vy,
+                          player.ring_count, len(self.rings), flags)
+
+    def render(self, background, draw_list):
+        """Draws the session's view offscreen and returns it as RGB24 bytes."""
+        if self.screen is None:
+            self.screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+        # Animation time follows the simulation, not the wall clock
+        ticks = self.frame * 1000 // FPS
+        draw_list.extend(LAYER_BACKGROUND, background.blit_items(self.camera_x, ticks))
+        queue_world(draw_list, self.level, self.rings, self.player, None,
+                    self.camera_x, ticks)
+        draw_list.submit(self.screen)
+        return pygame.image.tobytes(self.screen, 'RGB')
+
+
+class _ControlHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        conn = self.request
+        if conn.family != getattr(socket, 'AF_UNIX', None):
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        buf = bytearray()
+        draw_list = DrawList()
+        while True:
+            chunk = conn.recv(1 << 16)
+            if not chunk:
+                return
+            buf += chunk
+            replies = self.server.control.process(buf, draw_list)
+            if replies:
+                conn.sendall(replies)
+
+
+class ControlServer:
+    """Serves ControlSessions over TCP ("host:port") or a Unix socket (a path).
+
+    With listen=False nothing is bound up front; serve_async() then serves
+    the same protocol from a running game's event loop.
+    """
+
+    def __init__(self, address, map_data=level_map, listen=True):
+        self.level = Level(map_data)
+        self.background = None
+        self.sessions = {}
+        self.next_session = 1
+        self.lock = threading.Lock()
+        self.address = address
+        if not listen:
+            return
+
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            server_class = socketserver.ThreadingTCPServer
+            server_address = (host, int(port))
+        else:
+            if os.path.exists(address):
+                os.unlink(address)
+            server_class = socketserver.ThreadingUnixStreamServer
+            server_address = address
+        server_class.allow_reuse_address = True
+        server_class.daemon_threads = True
+        self.server = server_class(server_address, _ControlHandler)
+        self.server.control = self
+        self.address = self.server.server_address
+
+    def serve_forever(self):
+        self.server.serve_forever()
+
+    def shutdown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    async def serve_async(self, scheduler):
+        """Serves on the running event loop, answering requests in frame idle time."""
+        self.scheduler = scheduler
+        if ':' in self.address:
+            host, port = self.address.rsplit(':', 1)
+            server = await asyncio.start_server(self._serve_stream, host, int(port))
+        else:
+            if os.path.exists(self.address):
+                os.unlink(self.address)
+            server = await asyncio.start_unix_server(self._serve_stream, self.address)
+        async with server:
+            await server.serve_forever()
+
+    async def _serve_stream(self, reader, writer):
+        buf = bytearray()
+        partial = bytearray()
+        draw_list = DrawList()
+        try:
+            while chunk := await reader.read(1 << 16):
+                buf += chunk
+                # Each idle slice runs only what fits in it, so a long
+                # pipeline or step batch is spread over frames instead of
+                # stalling one
+                while True:
+                    await self.scheduler.idle()
+                    before = len(buf)
+                    replies = self.process(buf, draw_list, self.scheduler.idle_until, partial)
+                    if replies:
+                        writer.write(replies)
+                        await writer.drain()
+                    if not buf or len(buf) == before:
+                        break
+        finally:
+            writer.close()
+
+    def process(self, buf, draw_list, deadline=None, partial=None):
+        """Answers every complete request in buf, removes them and returns the replies.
+
+        With a deadline (a time.perf_counter() value) it stops once the
+        deadline has passed and leaves the rest in buf, even partway through
+        an OP_STEP: its unrun actions stay in buf as a shorter OP_STEP and
+        the states so far are kept in partial, a bytearray that goes with
+        buf from call to call.
+        """
+        replies = []
+        pos = 0
+        while len(buf) - pos >= HEADER.size:
+            op, flags, session, count = HEADER.unpack_from(buf, pos)
+            end = pos + HEADER.size + count
+            if len(buf) < end:
+                break  # Wait for the rest of this request
+            payload = bytes(buf[pos + HEADER.size:end])
+            if op == OP_STEP and deadline is not None:
+                reply, done = self._step_until(session, flags, payload, deadline, partial)
+                if reply is None:
+                    buf[pos:pos + HEADER.size + done] = HEADER.pack(op, flags, session,
+                                                                     count - done)
+                    break
+                replies.append(reply)
+            else:
+                replies.append(self.dispatch(op, flags, session, payload, draw_list))
+            pos = end
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+        del buf[:pos]
+        return b"".join(replies)
+
+    def _step_until(self, session_id, flags, payload, deadline, partial):
+        """Runs an OP_STEP until it is done or deadline passes.
+
+        Returns (reply, actions run); reply is None if time ran out first.
+        """
+        if partial is None:
+            partial = bytearray()
+        session = self.sessions.get(session_id)
+        if session is None:
+            partial.clear()
+            message = f"no session {session_id}".encode()
+            return HEADER.pack(OP_STEP, STATUS_ERROR, session_id, len(message)) + message, 0
+        with session.lock:
+            for done, actions in enumerate(payload, 1):
+                session.step(actions)
+                if flags & FLAG_ALL_STATES:
+                    partial += session.state()
+                if done < len(payload) and time.perf_counter() >= deadline:
+                    return None, done
+            body = bytes(partial) if partial else session.state()
+        partial.clear()
+        return HEADER.pack(OP_STEP, STATUS_OK, session_id, len(body)) + body, len(payload)
+
+    def dispatch(self, op, flags, session_id, payload, draw_list):
+        """Runs one request and returns its encoded reply.
+
+        A session is used by one request at a time, whichever connection
+        sent it; malformed requests get an error reply, never an exception.
+        """
+        try:
+            if op not in KNOWN_OPS:
+                raise ValueError(f"unknown opcode {op}")
+            if payload and op not in PAYLOAD_OPS:
+                raise ValueError(f"opcode {op} takes no payload")
+            if op == OP_CREATE:
+                with self.lock:
+                    if self.next_session > 0xFFFF:
+                        raise ValueError("out of session ids")
+                    session_id = self.next_session
+                    self.next_session += 1
+                    session = self.sessions[session_id] = ControlSession(self.level)
+                body = session.state()
+            elif op == OP_CLOSE:
+                with self.lock:
+                    if self.sessions.pop(session_id, None) is None:
+                        raise ValueError(f"no session {session_id}")
+                body = b""
+            else:
+                session = self.sessions.get(session_id)
+                if session is None:
+                    raise ValueError(f"no session {session_id}")
+                with session.lock:
+                    body = self._run(session, op, flags, payload, draw_list)
+        except (ValueError, KeyError, IndexError, struct.error) as exc:
+            message = str(exc).encode()
+            return HEADER.pack(op, STATUS_ERROR, session_id, len(message)) + message
+        return HEADER.pack(op, STATUS_OK, session_id, len(body)) + body
+
+    def _run(self, session, op, flags, payload, draw_list):
+        # A request on an existing session; returns the reply payload
+        if op == OP_STEP:
+            states = []
+            for actions in payload:
+                session.step(actions)
+                if flags & FLAG_ALL_STATES:
+                    states.append(session.state())
+            return b"".join(states) if states else session.state()
+        if op == OP_FRAME:
+            with self.lock:
+                if not self.level.baked:
+                    self.level.bake()
+                if self.background is None:
+                    self.background = ParallaxBackground()
+            return session.render(self.background, draw_list)
+        if op == OP_RESET:
+            session.reset()
+        elif op == OP_SAVE:
+            return session.save()
+        elif op == OP_LOAD:
+            session.load(payload)
+        return session.state()
+
+class ControlClient:
+    """Minimal blocking client for ControlServer, with request pipelining.
+
+    The send_* methods only queue requests; flush() sends everything queued
+    and returns the replies in order as (status, session, payload).
+    """
+
+    def __init__(self, address):
+        if ':' in address:
+            host, port = address.rsplit(':', 1)
+            self.sock = socket.create_connection((host, int(port)))
+            self.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        else:
+            self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self.sock.connect(address)
+        self.reader = self.sock.makefile('rb')
+        self.queued = []
+
+    def send(self, op, session=0, payload=b"", flags=0):
+        self.queued.append(HEADER.pack(op, flags, session, len(payload)) + payload)
+
+    def send_step(self, session, actions, all_states=False):
+        self.send(OP_STEP, session, bytes(actions), FLAG_ALL_STATES if all_states else 0)
+
+    def flush(self):
+        count = len(self.queued)
+        self.sock.sendall(b"".join(self.queued))
+        self.queued.clear()
+        replies = []
+        for _ in range(count):
+            op, status, session, size = HEADER.unpack(self.reader.read(HEADER.size))
+            replies.append((status, session, self.reader.read(size)))
+        return replies
+
+    def request(self, op, session=0, payload=b"", flags=0):
+        self.send(op, session, payload, flags)
+        status, session, body = self.flush()[0]
+        if status != STATUS_OK:
+            raise RuntimeError(body.decode())
+        return session, body
+
+    def create(self):
+        return self.request(OP_CREATE)[0]
+
+    def close(self):
+        self.reader.close()
+        self.sock.close()
+
+
+def serve(address, map_data=level_map):
+    server = ControlServer(address, map_data)
+    print(f"control server listening on {server.address}", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+
+# ----------------------------------------------------------------------
+# Level analysis
+#
+# The analyzer flies the real Player physics through a fixed set of moves
+# (walks, jumps with different amounts of air steering, spin dashes) from
+# every cell the player can stand in. A move ends when the player lands in
+# another cell, and the landing cells form a graph that is searched from
+# the start. Moves only see the tiles near the player, so a move's outcome
+# is memoized on the move plus the cells it looked at; the long flat and
+# repeated stretches of big levels are then flown once. Start cells are
+# split across a process pool.
+
+# A move is a list of (frames, actions) segments; frames=None holds the
+# actions until the move ends. 'dash' moves start fully spin-charged.
+ANALYSIS_MOVES = [('walk', [(None, ACTION_LEFT)]), ('walk', [(None, ACTION_RIGHT)]),
+                  ('jump', [(1, ACTION_JUMP), (None, 0)])]
+for _direction in (ACTION_LEFT, ACTION_RIGHT):
+    ANALYSIS_MOVES.append(('jump', [(1, ACTION_JUMP | _direction), (None, _direction)]))
+    for _steer in (4, 10, 20):
+        ANALYSIS_MOVES.append(('jump', [(1, ACTION_JUMP | _direction), (_steer, _direction),
+                                        (None, 0)]))
+    ANALYSIS_MOVES.append(('dash', [(None, 0)], _direction))
+    ANALYSIS_MOVES.append(('dash', [(1, ACTION_JUMP), (None, 0)], _direction))
+del _direction, _steer
+
+ANALYSIS_MAX_FRAMES = 240
+# The grid is padded with OUTSIDE cells far enough that no move can see
+# past the padding
+ANALYSIS_PAD = (8, 3, ANALYSIS_MAX_FRAMES * 15 // TILE_SIZE + 2)  # above, below, sides
+OUTSIDE = 255
+
+
+def standable_cells(solid):
+    """(col, row) of every open cell with solid ground directly below."""
+    rows, cols = np.nonzero(~solid[:-1] & solid[1:])
+    return list(zip(cols.tolist(), rows.tolist()))
+
+
+class _MoveExplorer:
+    """Flies ANALYSIS_MOVES from start cells of one level (one per worker).
+
+    A move only ever looks at the cells inside the bounding box of the tile
+    lookups it made, so its result holds for any start cell with the same
+    cells in that box. Results are memoized on (move, box, box contents)
+    and each new start cell is checked against every box already seen.
+    """
+
+    def __init__(self, map_data):
+        self.level = Level(map_data)
+        self.player = Player(0, 0)
+        self.keys = ActionKeys()
+        self.memo = {}
+        self.boxes = [{} for _ in ANALYSIS_MOVES]
+        self.hits = 0
+        self.misses = 0
+        up, down, side = ANALYSIS_PAD
+        self.grid = np.pad(self.level.terrain.grid, ((up, down), (side, side)),
+                           constant_values=OUTSIDE)
+
+    def _window(self, cell, box):
+        up, _, side = ANALYSIS_PAD
+        col, row = cell[0] + side, cell[1] + up
+        r0, r1, c0, c1 = box
+        return self.grid[row + r0:row + r1 + 1, col + c0:col + c1 + 1].tobytes()
+
+    def expand(self, cell):
+        """[(landing cell, rings touched)] for every move from cell that lands."""
+        col, row = cell
+        edges = []
+        for index, move in enumerate(ANALYSIS_MOVES):
+            for box in self.boxes[index]:
+                result = self.memo.get((index, box, self._window(cell, box)))
+                if result is not None:
+                    self.hits += 1
+                    break
+            else:
+                self.misses += 1
+                landing, path, box = self._fly(cell, move)
+                result = (landing, path)
+                self.boxes[index][box] = None
+                self.memo[index, box, self._window(cell, box)] = result
+            landing, path = result
+            if landing is not None:
+                dest = (col + landing[0], row + landing[1])
+                edges.append((dest, self._rings_on(cell, path)))
+        return edges
+
+    def _rings_on(self, cell, path):
+        # Only rings in cells the path's bounding box covers can be touched
+        x0, y0 = cell[0] * TILE_SIZE, cell[1] * TILE_SIZE
+        bounds = path[0].unionall(path).move(x0, y0)
+        ring_at = self.level.ring_at
+        touched = []
+        for col in range(bounds.left // TILE_SIZE, bounds.right // TILE_SIZE + 1):
+            for row in range(bounds.top // TILE_SIZE, bounds.bottom // TILE_SIZE + 1):
+                ring = ring_at.get((col, row))
+                if ring and ring.rect.move(-x0, -y0).collidelist(path) >= 0:
+                    touched.append((col, row))
+        return touched
+
+    def _fly(self, cell, move):
+        """Returns (landing offset or None, player rects relative to cell, lookup box)."""
+        kind, segments = move[0], move[1]
+        level, player, keys = self.level, self.player, self.keys
+        col, row = cell
+        x0, y0 = col * TILE_SIZE, row * TILE_SIZE
+        box = [0, 0, 0, 0]  # rows above/below and columns left/right of cell
+
+        # Standing centred in the cell, settled on the floor
+        player.xpos = (x0 + 2) << SUBPIXEL_SHIFT
+        player.ypos = (y0 << SUBPIXEL_SHIFT) + SUBPIXEL - 1
+        player.xsp = player.ysp = 0
+        player.rect.topleft = (x0 + 2, y0)
+        player.on_ground = True
+        player.angle = 0
+        player.spin_charge = SPIN_CHARGE_MAX if kind == 'dash' else 0
+        player.facing_right = len(move) < 3 or move[2] == ACTION_RIGHT
+
+        path = [player.rect.move(-x0, -y0)]
+        last_xpos = player.xpos
+        airborne = False
+        segment, left = 0, segments[0][0]
+        for frame in range(ANALYSIS_MAX_FRAMES):
+            keys.actions = segments[segment][1]
+            if left is not None:
+                left -= 1
+                if left == 0 and segment + 1 < len(segments):
+                    segment += 1
+                    left = segments[segment][0]
+
+            # The feet sensors can look up to a cell below the moved hitbox
+            rect = player.rect
+            c0, c1 = (rect.left - 16) // TILE_SIZE, (rect.right + 16) // TILE_SIZE
+            r0, r1 = (rect.top - 16) // TILE_SIZE, (rect.bottom + 16) // TILE_SIZE + 1
+            box = [min(box[0], r0 - row), max(box[1], r1 - row),
+                   min(box[2], c0 - col), max(box[3], c1 - col)]
+            player.update(level.terrain, [], keys)
+            path.append(player.rect.move(-x0, -y0))
+
+            if not player.on_ground:
+                airborne = True
+                if player.rect.top > level.height:
+                    return None, path, tuple(box)  # Fell out of the level
+                continue
+            if not airborne and frame and player.xpos == last_xpos:
+                return None, path, tuple(box)  # Walking into a wall
+            last_xpos = player.xpos
+            ground = self._ground_cell(player.rect)
+            if ground is not None and (airborne or ground != cell):
+                return (ground[0] - col, ground[1] - row), path, tuple(box)
+        return None, path, tuple(box)  # Still falling
+
+    def _ground_cell(self, rect):
+        # Feet on a slope are inside its cell; the ground cell is the open
+        # cell above it, as for a full tile
+        solid = self.level.solid
+        bottom = (rect.bottom - 1) // TILE_SIZE
+        if not 0 <= bottom < solid.shape[0]:
+            return None
+        for x in (rect.centerx, rect.left, rect.right - 1):
+            col = x // TILE_SIZE
+            if not 0 <= col < solid.shape[1]:
+                continue
+            row = bottom - 1 if solid[bottom, col] else bottom
+            if 0 <= row < solid.shape[0] - 1 and solid[row + 1, col]:
+                return col, row
+        return None
+
+
+_explorer = None
+
+
+def _init_explorer(map_data):
+    global _explorer
+    _explorer = _MoveExplorer(map_data)
+
+
+def _expand_cells(cells):
+    hits, misses = _explorer.hits, _explorer.misses
+    edges = {cell: _explorer.expand(cell) for cell in cells}
+    return edges, _explorer.hits - hits, _explorer.misses - misses
+
+
+def analyze_level(map_data, workers=None):
+    """Finds the rings and platforms the player cannot get to from the start.
+
+    Returns a dict with the standable and reachable cell counts, the
+    unreachable ring cells and the unreachable platforms as
+    (row, first col, last col) runs of standable cells.
+    """
+    start_time = time.perf_counter()
+    solid = build_solid_grid(map_data)
+    cells = standable_cells(solid)
+    workers = workers or os.cpu_count() or 1
+    batches = [cells[i::workers * 4] for i in range(workers * 4)]
+
+    if workers == 1:
+        _init_explorer(map_data)
+        results = list(map(_expand_cells, batches))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(
+                workers, initializer=_init_explorer, initargs=(map_data,)) as pool:
+            results = list(pool.map(_expand_cells, batches))
+    edges = {}
+    hits = misses = 0
+    for batch_edges, batch_hits, batch_misses in results:
+        edges.update(batch_edges)
+        hits += batch_hits
+        misses += batch_misses
+
+    level = Level(map_data)
+    start = (level.start[0] + 14) // TILE_SIZE, level.start[1] // TILE_SIZE
+    reached = {start}
+    rings = set()
+    frontier = [start]
+    while frontier:
+        cell = frontier.pop()
+        for dest, touched in edges.get(cell, ()):
+            rings.update(touched)
+            if dest not in reached:
+                reached.add(dest)
+                frontier.append(dest)
+
+    platforms = []
+    for col, row in sorted(cells, key=lambda cell: (cell[1], cell[0])):
+        if platforms and platforms[-1][0] == row and platforms[-1][2] == col - 1:
+            platforms[-1][2] = col
+            platforms[-1][3] |= (col, row) in reached
+        else:
+            platforms.append([row, col, col, (col, row) in reached])
+    return {
+        'standable': len(cells),
+        'reachable': len(reached),
+        'rings': len(level.rings),
+        'unreachable_rings': sorted(set(level.ring_at) - rings),
+        'unreachable_platforms': [tuple(p[:3]) for p in platforms if not p[3]],
+        'workers': workers,
+        'memo_hit_rate': hits / max(1, hits + misses),
+        'seconds': time.perf_counter() - start_time,
+    }
+
+
+def print_analysis(report):
+    print(f"analysis: {report['standable']} standable cells, {report['reachable']} reachable "
+          f"from the start, {report['rings']} rings "
+          f"({report['seconds'] * 1000:.0f} ms, {report['workers']} workers, "
+          f"{report['memo_hit_rate']:.0%} of moves memoized)")
+    rings = report['unreachable_rings']
+    print(f"  unreachable rings: {len(rings)}"
+          + "".join(f"\n    col {col}, row {row}" for col, row in rings))
+    platforms = report['unreachable_platforms']
+    print(f"  unreachable platforms: {len(platforms)}"
+          + "".join(f"\n    row {row}, cols {first}-{last}" for row, first, last in platforms))
+
+# ----------------------------------------------------------------------
+# Benchmarks (run headless with SDL_VIDEODRIVER=dummy)
+
+def _ms_per_frame(step, frames):
+    start = time.perf_counter()
+    for frame in range(frames):
+        step(frame)
+    return (time.perf_counter() - start) * 1000 / frames
+
+
+def benchmark_draw(frames=500):
+    """Per-object draw methods versus the batched draw list."""
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    level = Level(level_map)
+    level.bake()
+    tiles, rings = level.tiles, level.rings
+    player = Player(*level.start)
+    particles = ParticlePool()
+    particles.ring_scatter(300, 300, 32)
+    draw_list = DrawList()
+    max_camera_x = len(level_map[0]) * TILE_SIZE - SCREEN_WIDTH
+
+    def camera(frame):
+        # Sweep the whole level so culling is exercised
+        return frame * 7 % max_camera_x
+
+    def per_object(frame):
+        camera_x = camera(frame)
+        for tile in tiles:
+            tile.draw(screen, camera_x)
+        for ring in rings:
+            ring.draw(screen, camera_x)
+        player.draw(screen, camera_x)
+        particles.draw(screen, camera_x)
+
+    def batched(frame):
+        queue_world(draw_list, level, rings, player, particles, camera(frame))
+        draw_list.submit(screen)
+
+    per_object(0), batched(0)  # bake shared surfaces outside the timings
+    slow = _ms_per_frame(per_object, frames)
+    fast = _ms_per_frame(batched, frames)
+    print(f"draw: {len(tiles)} tiles, {len(rings)} rings, {frames} frames "
+          f"({'fblits' if HAS_FBLITS else 'blits'})")
+    print(f"  per-object draw   {slow:7.3f} ms/frame")
+    print(f"  batched draw list {fast:7.3f} ms/frame  ({slow / fast:.1f}x)")
+
+
+def benchmark_palette(count=2000):
+    """Recolouring the player: palette swap on the 8-bit sheet versus a re-bake."""
+    pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    player = Player(0, 0)
+    names = list(SPRITE_PALETTES)
+
+    start = time.perf_counter()
+    for i in range(count):
+        Player.set_palette(names[i % len(names)])
+    swap_us = (time.perf_counter() - start) / count * 1e6
+    rebakes = max(1, count // 100)
+    start = time.perf_counter()
+    for _ in range(rebakes):
+        player._load_sprites()
+    bake_us = (time.perf_counter() - start) / rebakes * 1e6
+    Player.set_palette('normal')
+    sheet = Player.sprite_sheet()
+    print(f"palette: {sheet.get_width()}x{sheet.get_height()} "
+          f"8-bit sheet, {len(names)} palettes")
+    print(f"  palette swap {swap_us:9.2f} us")
+    print(f"  re-bake      {bake_us:9.2f} us  ({bake_us / swap_us:.0f}x)")
+
+
+def benchmark_zones():
+    """Memory and build time of all time periods resident, shared versus separate."""
+    pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    maps = {name: apply_map_edits(level_map, ZONE_EDITS.get(name, ())) for name in ZONE_PERIODS}
+
+    def resident(levels):
+        keys = {key for level in levels for key in level.chunk_keys}
+        tiles = {id(tile) for level in levels for tile in level.tiles}
+        size = sum(surface_bytes(surface_cache.peek(key)) for key in keys)
+        return len(keys), len(tiles), size / 1024
+
+    start = time.perf_counter()
+    separate = []
+    for name in ZONE_PERIODS:
+        level = Level(maps[name])
+        level.bake()
+        separate.append(level)
+    separate_ms = (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    present = Level(maps['present'])
+    present.bake()
+    shared = [present.derive(maps[name]) if name != 'present' else present
+              for name in ZONE_PERIODS]
+    shared_ms = (time.perf_counter() - start) * 1000
+
+    print(f"zones: {len(ZONE_PERIODS)} periods of a {len(level_map[0])}x{len(level_map)} map")
+    for label, levels, ms in (("separate levels", separate, separate_ms),
+                              ("copy-on-write", shared, shared_ms)):
+        chunks, tiles, kib = resident(levels)
+        print(f"  {label:16} {chunks:3} chunk surfaces {kib:8.0f} KiB  "
+              f"{tiles:4} tiles  built in {ms:6.1f} ms")
+
+
+def benchmark_pacing(frames=180, work_ms=4.0):
+    """Frame interval error under load: Clock.tick versus FrameScheduler."""
+    target = 1000 / FPS
+
+    def busy(ms):
+        end = time.perf_counter() + ms / 1000
+        while time.perf_counter() < end:
+            pass
+
+    def report(label, intervals, extra=""):
+        errors = sorted(abs(interval - target) for interval in intervals[1:])
+        print(f"  {label:30} mean error {sum(errors) / len(errors):6.3f} ms  "
+              f"p99 {errors[int(len(errors) * 0.99)]:6.3f} ms{extra}")
+
+    clock = pygame.time.Clock()
+    intervals = []
+    start = time.perf_counter()
+    for _ in range(frames):
+        busy(work_ms)
+        clock.tick(FPS)
+        now = time.perf_counter()
+        intervals.append((now - start) * 1000)
+        start = now
+
+    async def scheduled():
+        scheduler = FrameScheduler()
+        steps = [0]
+
+        async def background():
+            # Stand-in for streaming or uploads: 1 ms slices of work
+            while True:
+                await scheduler.idle(need=0.0015)
+                busy(1.0)
+                steps[0] += 1
+
+        tasks = [asyncio.create_task(background()) for _ in range(2)]
+        ticked = []
+        for _ in range(frames):
+            busy(work_ms)
+            ticked.append(await scheduler.tick(FPS))
+        for task in tasks:
+            task.cancel()
+        return ticked, steps[0]
+
+    print(f"pacing: {frames} frames of {work_ms:g} ms work at {FPS} fps")
+    report("Clock.tick", intervals)
+    ticked, steps = asyncio.run(scheduled())
+    report("FrameScheduler + 2 tasks", ticked,
+           f"  ({steps / frames:.1f} ms of background work per frame)")
+
+
+def benchmark_rings(frames=200, count=2000):
+    """Rasterizing two circles per ring versus blitting the shared spin frames."""
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    rng = random.Random(1)
+    rings = [Ring(rng.randrange(SCREEN_WIDTH), rng.randrange(SCREEN_HEIGHT)) for _ in range(count)]
+    draw_list = DrawList()
+
+    def rasterized(frame):
+        for ring in rings:
+            center = ring.rect.center
+            pygame.draw.circle(screen, RING_MAIN, center, TILE_SIZE//4)
+            pygame.draw.circle(screen, RING_HOLE, center, TILE_SIZE//6)
+
+    def per_ring_blit(frame):
+        strip = Ring.get_strip()
+        for ring in rings:
+            ring.draw(screen, 0, frame * 17, strip)
+
+    def batched(frame):
+        strip = Ring.get_strip()
+        area = Ring.frame_area(frame * 17)
+        draw_list.extend(LAYER_RINGS, [(strip, ring.rect.topleft, area) for ring in rings])
+        draw_list.submit(screen)
+
+    Ring.get_strip()
+    slow = _ms_per_frame(rasterized, frames)
+    blit = _ms_per_frame(per_ring_blit, frames)
+    fast = _ms_per_frame(batched, frames)
+    print(f"rings: {count} on screen, {frames} frames")
+    print(f"  two circles per ring    {slow:7.3f} ms/frame")
+    print(f"  Ring.draw frame blit    {blit:7.3f} ms/frame  ({slow / blit:.1f}x)")
+    print(f"  batched frame blits     {fast:7.3f} ms/frame  ({slow / fast:.1f}x)")
+
+
+def benchmark_control(steps=6000):
+    """Remote stepping throughput: per-frame round trips versus batching and pipelining."""
+    address = os.path.join(tempfile.mkdtemp(), "control.sock")
+    server = ControlServer(address)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    client = ControlClient(address)
+    session = client.create()
+    run_right = [ACTION_RIGHT] * 60
+
+    def measure(label, batch, depth):
+        start = time.perf_counter()
+        for _ in range(steps // (batch * depth)):
+            for _ in range(depth):
+                client.send_step(session, run_right[:batch])
+            client.flush()
+        elapsed = time.perf_counter() - start
+        print(f"  {label:32} {steps / elapsed:9.0f} frames/s")
+
+    print(f"control: {steps} frames per mode over a Unix socket")
+    measure("1 frame per request", 1, 1)
+    measure("60 frames per request", 60, 1)
+    measure("1 frame x 50 pipelined", 1, 50)
+    measure("60 frames x 10 pipelined", 60, 10)
+    client.close()
+    server.shutdown()
+
+
+def benchmark_snapshot(count=20000):
+    """Save/restore round trips of a mid-run state, as a search agent would."""
+    map_data = generate_level(320, 12, seed=0, ring_count=200)
+    level = Level(map_data)
+    player = Player(*level.start)
+    rings = list(level.rings)
+    keys = ActionKeys(ACTION_RIGHT | ACTION_JUMP)
+    for _ in range(120):
+        player.update(level.terrain, rings, keys)
+    snapshot = GameSnapshot(level)
+    buffer = snapshot.new_buffer()
+
+    start = time.perf_counter()
+    for frame in range(count):
+        snapshot.save(buffer, frame, (player,), (0.0,), rings)
+    save_us = (time.perf_counter() - start) / count * 1e6
+    start = time.perf_counter()
+    for _ in range(count):
+        snapshot.restore(buffer, (player,), rings)
+    restore_us = (time.perf_counter() - start) / count * 1e6
+    print(f"snapshot: {snapshot.size} bytes, {len(level.rings)} rings, {count} round trips")
+    print(f"  save    {save_us:7.2f} us")
+    print(f"  restore {restore_us:7.2f} us")
+
+
+def benchmark_scaling(widths=(80, 320, 1280, 5120), height=12, frames=60):
+    """How each subsystem's cost grows with level size, on generated levels."""
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    print(f"scaling: generated levels {height} rows high, seed 0")
+    print(f"  {'width':>6} {'tiles':>7} {'load':>9} {'bake':>9} "
+          f"{'update':>12} {'tile draw':>12} {'draw list':>12}")
+    for width in widths:
+        map_data = generate_level(width, height, seed=0, ring_count=width // 4)
+
+        start = time.perf_counter()
+        level = Level(map_data)
+        load_ms = (time.perf_counter() - start) * 1000
+        start = time.perf_counter()
+        level.bake()
+        bake_ms = (time.perf_counter() - start) * 1000
+
+        player = Player(*level.start)
+        rings = list(level.rings)
+        keys = ActionKeys(ACTION_RIGHT)
+        draw_list = DrawList()
+        camera_x = level.width // 2
+
+        def update(frame):
+            player.update(level.terrain, rings, keys)
+
+        def tile_draw(frame):
+            for tile in level.tiles:
+                tile.draw(screen, camera_x)
+
+        def batched(frame):
+            queue_world(draw_list, level, rings, player, None, camera_x, frame)
+            draw_list.submit(screen)
+
+        update_ms = _ms_per_frame(update, frames)
+        tile_ms = _ms_per_frame(tile_draw, frames)
+        list_ms = _ms_per_frame(batched, frames)
+        print(f"  {width:>6} {len(level.tiles):>7} {load_ms:>7.1f}ms {bake_ms:>7.1f}ms "
+              f"{update_ms:>8.3f}ms/f {tile_ms:>8.3f}ms/f {list_ms:>8.3f}ms/f")
+
+
+def benchmark_viewports(counts=(1, 2, 4), frames=300):
+    """Split-screen draw cost for 1, 2 and 4 viewports over shared caches."""
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    level = Level(level_map)
+    level.bake()
+    background = ParallaxBackground()
+    particles = ParticlePool()
+    particles.ring_scatter(300, 300, 32)
+    rings = level.rings
+    print(f"viewports: {len(level.tiles)} tiles, {len(rings)} rings, {frames} frames")
+    single = None
+    for count in counts:
+        # Racers spread along the level so every camera culls differently
+        players = [Player(level.start[0] + i * level.width // (count + 1), level.start[1])
+                   for i in range(count)]
+        viewports = split_viewports(screen, players)
+
+        def draw(frame):
+            for view in viewports:
+                view.player.rect.x = (view.player.rect.x + 7) % level.width
+                view.follow(level)
+                view.draw(level, background, rings, players, particles, frame * 16)
+
+        draw(0)
+        ms = _ms_per_frame(draw, frames)
+        single = single or ms
+        print(f"  {count} x {viewports[0].rect.width:>3}px  {ms:7.3f} ms/frame  "
+              f"{ms / count:7.3f} ms/viewport  ({ms / single:.2f}x one viewport)")
+
+
+def benchmark_renderer(frames=300, scales=(1, 2)):
+    """Whole frames (backdrop, world, present) blitted to the display versus texture copies."""
+    level = Level(level_map)
+    level.bake()
+    background = ParallaxBackground()
+    player = Player(*level.start)
+    particles = ParticlePool()
+    particles.ring_scatter(300, 300, 32)
+    draw_list = DrawList()
+    max_camera_x = level.width - SCREEN_WIDTH
+
+    def queue(frame):
+        camera_x = frame * 7 % max_camera_x
+        draw_list.extend(LAYER_BACKGROUND, background.blit_items(camera_x, frame * 16))
+        queue_world(draw_list, level, level.rings, player, particles, camera_x, frame * 16)
+
+    print(f"renderer: {len(level.tiles)} tiles, {len(level.rings)} rings, {frames} frames, "
+          f"{os.environ.get('SDL_VIDEODRIVER', 'default')} video driver, software renderer")
+    for scale in scales:
+        size = (SCREEN_WIDTH * scale, SCREEN_HEIGHT * scale)
+        display = pygame.display.set_mode(size)
+        # Scaled, the surface path draws at game size and stretches onto the display
+        frame_surface = display if scale == 1 else pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+
+        def surfaces(frame):
+            queue(frame)
+            draw_list.submit(frame_surface)
+            if scale != 1:
+                pygame.transform.scale(frame_surface, size, display)
+            pygame.display.flip()
+
+        renderer = TextureRenderer("benchmark", scale)
+
+        def textures(frame):
+            queue(frame)
+            renderer.submit(draw_list)
+            renderer.present()
+
+        surfaces(0), textures(0)  # upload textures outside the timings
+        slow = _ms_per_frame(surfaces, frames)
+        fast = _ms_per_frame(textures, frames)
+        renderer.close()
+        print(f"  {size[0]}x{size[1]} surface blits   {slow:7.3f} ms/frame")
+        print(f"  {size[0]}x{size[1]} texture copies  {fast:7.3f} ms/frame  ({slow / fast:.2f}x)")
+
+
+def benchmark_profiler(frames=2000, rates=(PROFILE_RATE, 1000), rounds=5):
+    """Cost of the sampling profiler on unpaced game frames (update and draw)."""
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    level = Level(level_map)
+    level.bake()
+    background = ParallaxBackground()
+    player = Player(*level.start)
+    particles = ParticlePool()
+    draw_list = DrawList()
+    keys = ActionKeys(ACTION_RIGHT)
+
+    def step(frame):
+        keys.actions = ACTION_RIGHT | (ACTION_JUMP if frame % 40 == 0 else 0)
+        player.update(level.terrain, level.rings, keys)
+        if 'jump' in player.events:
+            particles.dust(player.rect.centerx, player.rect.bottom)
+        particles.update(level.terrain)
+        camera_x = frame * 7 % (level.width - SCREEN_WIDTH)
+        draw_list.extend(LAYER_BACKGROUND, background.blit_items(camera_x, frame * 16))
+        queue_world(draw_list, level, level.rings, player, particles, camera_x, frame * 16)
+        draw_list.submit(screen)
+        if player.rect.x > level.width - 2 * TILE_SIZE:
+            player.xpos = level.start[0] << SUBPIXEL_SHIFT
+
+    # Rounds interleave the settings and keep each one's best, so drift in
+    # machine speed does not read as profiler cost
+    best = dict.fromkeys((0,) + rates, math.inf)
+    samples = dict.fromkeys(rates, 0)
+    sampler_ms = dict.fromkeys(rates, 0.0)
+    step(0)
+    for _ in range(rounds):
+        for rate in best:
+            profiler = SamplingProfiler(None, rate) if rate else None
+            best[rate] = min(best[rate], _ms_per_frame(step, frames))
+            if profiler:
+                samples[rate] += profiler.close()
+                sampler_ms[rate] += profiler.cpu_time * 1000
+    base = best[0]
+    print(f"profiler: {frames} unpaced frames, best of {rounds}")
+    print(f"  off        {base:7.3f} ms/frame")
+    for rate in rates:
+        # The sampler's own CPU time is exact; the frame-time delta also
+        # catches GIL hand-offs but is only good to a few percent
+        sampler = sampler_ms[rate] / (base * frames * rounds) * 100
+        print(f"  {rate:>4} Hz    {best[rate]:7.3f} ms/frame  "
+              f"({(best[rate] / base - 1) * 100:+.1f}%; sampler thread {sampler:.2f}% of run, "
+              f"{samples[rate] // rounds} samples/round)")
+
+
+def benchmark_surfaces(width=2000, budgets=(None, 32, 8), frames=600):
+    """Resident size, hit rate and frame time of one pass over a long level per budget."""
+    screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+    map_data = generate_level(width, 12, seed=0, ring_count=width // 4)
+    budget = surface_cache.budget
+    print(f"surfaces: generated {width}x12 level, camera sweeps it in {frames} frames")
+    for mb in budgets:
+        surface_cache.clear()
+        surface_cache.budget = math.inf if mb is None else mb * 1024 * 1024
+        level = Level(map_data)
+        level.bake()
+        background = ParallaxBackground()
+        player = Player(*level.start)
+        draw_list = DrawList()
+        step = (level.width - SCREEN_WIDTH) / frames
+        # Loading bakes everything, so only count what the sweep itself does
+        surface_cache.hits = surface_cache.misses = surface_cache.evictions = 0
+
+        def sweep(frame):
+            camera_x = int(frame * step)
+            draw_list.extend(LAYER_BACKGROUND, background.blit_items(camera_x, frame * 16))
+            queue_world(draw_list, level, level.rings, player, None, camera_x, frame * 16)
+            draw_list.submit(screen)
+
+        ms = _ms_per_frame(sweep, frames)
+        label = "unbounded" if mb is None else f"{mb} MiB"
+        lookups = surface_cache.hits + surface_cache.misses
+        print(f"  {label:>9}  {surface_cache.resident / 2**20:6.1f} MiB resident  "
+              f"{surface_cache.hits / lookups * 100:5.1f}% hits  "
+              f"{surface_cache.evictions:4} evicted  {ms:6.3f} ms/frame")
+    surface_cache.clear()
+    surface_cache.budget = budget
+
+
+def benchmark_startup(runs=10):
+    """Cold start: process launch until the first menu frame is presented."""
+    env = dict(os.environ)
+    env.setdefault('SDL_VIDEODRIVER', 'dummy')
+    env['PYGAME_HIDE_SUPPORT_PROMPT'] = '1'
+    command = [sys.executable, os.path.abspath(__file__), '--exit-after-first-frame']
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        with subprocess.Popen(command, env=env, stdout=subprocess.PIPE, text=True) as child:
+            for line in child.stdout:
+                if line.strip() == "first-frame":
+                    times.append((time.perf_counter() - start) * 1000)
+                    break
+        if child.returncode:
+            raise RuntimeError(f"startup run exited with status {child.returncode}")
+    times.sort()
+    print(f"startup: {runs} runs, median {times[len(times) // 2]:.1f} ms "
+          f"(min {times[0]:.1f}, max {times[-1]:.1f})")
+
+
+BENCHMARKS = {
+    'control': benchmark_control,
+    'draw': benchmark_draw,
+    'pacing': benchmark_pacing,
+    'palette': benchmark_palette,
+    'profiler': benchmark_profiler,
+    'renderer': benchmark_renderer,
+    'rings': benchmark_rings,
+    'scaling': benchmark_scaling,
+    'snapshot': benchmark_snapshot,
+    'startup': benchmark_startup,
+    'surfaces': benchmark_surfaces,
+    'viewports': benchmark_viewports,
+    'zones': benchmark_zones,
+}
+
+# ----------------------------------------------------------------------
+def _level_size(text):
+    try:
+        width, height = (int(part) for part in text.lower().split('x'))
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected WIDTHxHEIGHT, got {text!r}")
+    if width < 1 or height < 3:
+        raise argparse.ArgumentTypeError(f"levels need at least 1 column and 3 rows, got {text!r}")
+    return width, height
+
+
+def _positive_int(text):
+    try:
+        value = int(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"expected a whole number, got {text!r}")
+    if value <= 0:
+        raise argparse.ArgumentTypeError(f"must be positive, got {value}")
+    return value
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Sonic CD - Green Hill Zone (Pixel Asset Demo)")
+    parser.add_argument('--bench', choices=sorted(BENCHMARKS),
+                        help="run a benchmark instead of the game and exit")
+    parser.add_argument('--record', metavar='PATH',
+                        help="record gameplay frames to PATH")
+    parser.add_argument('--record-format', choices=FrameCapture.FORMATS, default='y4m',
+                        help="recording format (default: %(default)s)")
+    parser.add_argument('--telemetry', metavar='PATH',
+                        help="write per-frame telemetry records to PATH")
+    parser.add_argument('--telemetry-rate', type=int, default=1, metavar='N',
+                        help="keep one telemetry record every N frames (default: %(default)s)")
+    parser.add_argument('--telemetry-format', choices=Telemetry.FORMATS, default='jsonl',
+                        help="telemetry encoding (default: %(default)s)")
+    parser.add_argument('--telemetry-sink', metavar='ADDRESS',
+                        help="also stream telemetry to a listener on HOST:PORT or a Unix socket")
+    parser.add_argument('--renderer', choices=('surface', 'texture'), default='surface',
+                        help="draw by blitting surfaces or by copying SDL2 textures "
+                             "(default: %(default)s)")
+    parser.add_argument('--scale', type=int, default=1, metavar='N',
+                        help="window scale for --renderer texture (default: %(default)s)")
+    parser.add_argument('--accelerated', action='store_true',
+                        help="use a GPU renderer for --renderer texture instead of software")
+    parser.add_argument('--profile', metavar='PATH',
+                        help="sample the game's stack and write collapsed stacks "
+                             "(flamegraph input) to PATH on exit")
+    parser.add_argument('--profile-rate', type=_positive_int, default=PROFILE_RATE, metavar='HZ',
+                        help="stack samples per second for --profile (default: %(default)s)")
+    parser.add_argument('--surface-budget', type=float, metavar='MB',
+                        help="memory for baked surfaces before the least recently used are "
+                             f"dropped and re-baked (default: {SURFACE_BUDGET >> 20})")
+    parser.add_argument('--headless', action='store_true',
+                        help="no window or sound: skip the menu and play a single run")
+    parser.add_argument('--frames', type=int, metavar='N',
+                        help="end the run after N gameplay frames")
+    parser.add_argument('--generate', type=_level_size, metavar='WxH',
+                        help="play (or serve) a generated level of W by H tiles")
+    parser.add_argument('--level', metavar='PATH',
+                        help="play (or serve) the level map in PATH, one row per line")
+    parser.add_argument('--watch', action='store_true',
+                        help="reload --level whenever the file changes (keeps the player)")
+    parser.add_argument('--seed', type=int, default=0,
+                        help="seed for --generate (default: %(default)s)")
+    parser.add_argument('--analyze', action='store_true',
+                        help="report rings and platforms the player cannot reach, then exit")
+    parser.add_argument('--workers', type=_positive_int, metavar='N',
+                        help="processes for --analyze (default: one per CPU)")
+    parser.add_argument('--serve', metavar='ADDRESS',
+                        help="run the headless control server on HOST:PORT or a Unix socket path")
+    parser.add_argument('--control', metavar='ADDRESS',
+                        help="serve the control protocol from the running game as well")
+    # Used by the startup benchmark
+    parser.add_argument('--exit-after-first-frame', action='store_true',
+                        help=argparse.SUPPRESS)
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.headless or args.serve:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+        os.environ['SDL_AUDIODRIVER'] = 'dummy'
+
+    # Only video is started up front; fonts and the mixer start on first
+    # use and the joystick subsystem is never brought up
+    pygame.display.init()
+    if args.bench:
+        BENCHMARKS[args.bench]()
+        return
+    if args.watch and not args.level:
+        raise SystemExit("--watch needs --level PATH")
+    if (args.scale != 1 or args.accelerated) and args.renderer != 'texture':
+        raise SystemExit("--scale and --accelerated need --renderer texture")
+    if args.surface_budget is not None:
+        surface_cache.budget = int(args.surface_budget * 1024 * 1024)
+    if args.level:
+        map_data = load_map_file(args.level)
+    elif args.generate:
+        map_data = generate_level(*args.generate, seed=args.seed)
+    else:
+        map_data = level_map
+    # Only the built-in zone has other time periods
+    periods = {}
+    if map_data is level_map:
+        periods = {name: apply_map_edits(level_map, edits) for name, edits in ZONE_EDITS.items()}
+    if args.analyze:
+        print_analysis(analyze_level(map_data, args.workers))
+        return
+    if args.serve:
+        serve(args.serve, map_data)
+        return
+
+    profiler = SamplingProfiler(args.profile, args.profile_rate) if args.profile else None
+    try:
+        asyncio.run(run_game(args, map_data, periods))
+    finally:
+        if profiler:
+            samples = profiler.close()
+            print(f"profile: {samples} samples written to {args.profile}")
+
+async def run_game(args, map_data, periods=None):
+    """The menu and game loops, with background tasks sharing each frame's slack."""
+    renderer = None
+    if args.renderer == 'texture':
+        # Menus still draw onto a plain surface that the renderer uploads
+        renderer = TextureRenderer("Sonic CD - Green Hill Zone (Pixel Asset Demo)",
+                                   args.scale, args.accelerated)
+        screen = pygame.Surface((SCREEN_WIDTH, SCREEN_HEIGHT))
+    else:
+        screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
+        pygame.display.set_caption("Sonic CD - Green Hill Zone (Pixel Asset Demo)")
+    clock = FrameScheduler()
+    loader = LevelLoader(map_data, clock, periods)
+    watcher = LevelWatcher(args.level) if args.watch else None
+    capture = FrameCapture(args.record, screen, args.record_format) if args.record else None
+    telemetry = None
+    if args.telemetry or args.telemetry_sink:
+        telemetry = Telemetry(args.telemetry, args.telemetry_rate, args.telemetry_format)
+    upload = None
+    if args.telemetry_sink:
+        upload = asyncio.create_task(telemetry.upload(args.telemetry_sink, clock))
+    control = None
+    if args.control:
+        server = ControlServer(args.control, map_data, listen=False)
+        control = asyncio.create_task(server.serve_async(clock))
+
+    state = MENU
+
+    try:
+        if args.headless:
+            loader.start()
+            await play_game(screen, clock, loader, capture, telemetry, args.frames, watcher,
+                            renderer=renderer)
+            return
+        while True:
+            if state == MENU:
+                state = await main_menu(screen, clock, loader, args.exit_after_first_frame,
+                                        renderer)
+            elif state in (PLAYING, PLAYING_SPLIT):
+                state = await play_game(screen, clock, loader, capture, telemetry, args.frames,
+                                        watcher, split=state == PLAYING_SPLIT, renderer=renderer)
+    finally:
+        clock.stop()
+        if control:
+            control.cancel()
+        if capture:
+            capture.close()
+        if telemetry:
+            telemetry.close()
+        if upload:
+            await upload
+        if renderer:
+            renderer.close()
+        if args.headless or args.surface_budget is not None:
+            print(surface_cache.report())
 
 if __name__ == "__main__":
     main()
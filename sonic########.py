@@ -3,9 +3,6 @@ import sys
 import math
 import random
 
-# Initialize Pygame
-pygame.init()
-
 # Constants
 SCREEN_WIDTH = 600
 SCREEN_HEIGHT = 400
@@ -23,6 +20,8 @@ GROUND_COLOR = (34, 139, 34)
 GROUND_STRIPE = (85, 107, 47)
 RING_MAIN = (255, 255, 0)
 RING_HOLE = (50, 50, 50)
+RING_SHINE = (255, 255, 200)
+RING_COLORKEY = (255, 0, 255)
 SONIC_BLUE = (66, 170, 255)
 SONIC_SKIN = (255, 220, 150)
 SONIC_RED = (220, 20, 20)
@@ -32,6 +31,10 @@ MENU_BG = (30, 30, 60)
 TEXT_COLOR = (255, 255, 255)
 SELECTED_COLOR = (255, 255, 0)
 
+# Ring spin animation
+RING_FRAMES = 8
+RING_FRAME_MS = 60
+
 # Game states
 MENU = 0
 PLAYING = 1
@@ -224,19 +227,57 @@ class Tile:
             y = screen_rect.y
             pygame.draw.line(screen, (50, 150, 50), (x, y), (x+4, y-4), 2)
 
+# ----------------------------------------------------------------------
+def _bake_ring_frames():
+    """Pre-renders the ring spin into one strip; returns it with a rect per frame.
+
+    Every ring blits its frame out of this single colourkeyed, RLE-encoded
+    strip, so the pixels are shared and transparent runs cost nothing.
+    """
+    size = TILE_SIZE//2 + 1
+    center = size // 2
+    strip = pygame.Surface((size * RING_FRAMES, size))
+    strip.fill(RING_COLORKEY)
+    areas = []
+    for i in range(RING_FRAMES):
+        area = pygame.Rect(i * size, 0, size, size)
+        frame = strip.subsurface(area)
+        # Half a turn is enough: the ring looks the same from behind
+        squash = abs(math.cos(i * math.pi / RING_FRAMES))
+        if i == 0:
+            pygame.draw.circle(frame, RING_MAIN, (center, center), TILE_SIZE//4)
+            pygame.draw.circle(frame, RING_HOLE, (center, center), TILE_SIZE//6)
+        else:
+            outer_w = max(2, round((TILE_SIZE//2) * squash))
+            pygame.draw.ellipse(frame, RING_MAIN, (center - outer_w // 2, 0, outer_w, size - 1))
+            hole_w = round((TILE_SIZE//3) * squash)
+            if hole_w >= 2:
+                pygame.draw.ellipse(frame, RING_HOLE, (center - hole_w // 2, 3, hole_w, size - 7))
+        pygame.draw.line(frame, RING_SHINE, (center - 1, 2), (center - 1, 3))
+        areas.append(area)
+    del frame  # A live subsurface would keep the strip from being RLE-encoded
+    strip.set_colorkey(RING_COLORKEY, pygame.RLEACCEL)
+    return strip, areas
+
 # ----------------------------------------------------------------------
 class Ring:
+    # Spin animation strip shared by every ring, built on first use
+    strip = None
+    frame_areas = None
+
     def __init__(self, x, y):
         self.rect = pygame.Rect(x, y, TILE_SIZE//2, TILE_SIZE//2)
 
+    @classmethod
+    def frame_area(cls, ticks):
+        """The strip rect every ring shows at ticks: one global animation clock."""
+        if cls.strip is None:
+            cls.strip, cls.frame_areas = _bake_ring_frames()
+        return cls.frame_areas[ticks // RING_FRAME_MS % RING_FRAMES]
+
     def draw(self, screen, camera_x):
-        screen_rect = self.rect.copy()
-        screen_rect.x -= camera_x
-        center = screen_rect.center
-        # Draw outer ring (yellow)
-        pygame.draw.circle(screen, RING_MAIN, center, TILE_SIZE//4)
-        # Draw inner hole (dark) to make it look like a ring
-        pygame.draw.circle(screen, RING_HOLE, center, TILE_SIZE//6)
+        area = self.frame_area(pygame.time.get_ticks())
+        screen.blit(self.strip, (self.rect.x - camera_x, self.rect.y), area)
 
 # ----------------------------------------------------------------------
 def draw_sky(screen):
@@ -274,9 +315,30 @@ def load_level(map_data):
                 rings.append(Ring(col_idx * TILE_SIZE, row_idx * TILE_SIZE - TILE_SIZE//2))
     return tiles, rings
 
+# ----------------------------------------------------------------------
+# Fonts and rendered text are created on first use and cached
+_fonts = {}
+_text_cache = {}
+
+def get_font(size):
+    """Returns the default font at size, starting pygame.font if needed."""
+    font = _fonts.get(size)
+    if font is None:
+        if not pygame.font.get_init():
+            pygame.font.init()
+        font = _fonts[size] = pygame.font.Font(None, size)
+    return font
+
+def render_text(text, color, size=36):
+    """Returns a cached antialiased rendering of text."""
+    key = (text, color, size)
+    surf = _text_cache.get(key)
+    if surf is None:
+        surf = _text_cache[key] = get_font(size).render(text, True, color)
+    return surf
+
 # ----------------------------------------------------------------------
 def main_menu(screen, clock):
-    font = pygame.font.Font(None, 36)
     options = ["Start Game", "Quit"]
     selected = 0
 
@@ -299,13 +361,13 @@ def main_menu(screen, clock):
 
         screen.fill(MENU_BG)
 
-        title = font.render("Sonic Advance (Green Hill Zone)", True, TEXT_COLOR)
+        title = render_text("Sonic Advance (Green Hill Zone)", TEXT_COLOR)
         title_rect = title.get_rect(center=(SCREEN_WIDTH//2, 100))
         screen.blit(title, title_rect)
 
         for i, opt in enumerate(options):
             color = SELECTED_COLOR if i == selected else TEXT_COLOR
-            text = font.render(opt, True, color)
+            text = render_text(opt, color)
             text_rect = text.get_rect(center=(SCREEN_WIDTH//2, 200 + i*50))
             screen.blit(text, text_rect)
 
@@ -355,6 +417,9 @@ def play_game(screen, clock):
 
 # ----------------------------------------------------------------------
 def main():
+    # Only video is started up front; fonts start on first use and the
+    # mixer and joystick subsystems are never brought up
+    pygame.display.init()
     screen = pygame.display.set_mode((SCREEN_WIDTH, SCREEN_HEIGHT))
     pygame.display.set_caption("Sonic Advance - Green Hill Zone (Vibe Coded)")
     clock = pygame.time.Clock()